@@ -0,0 +1,152 @@
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import tracemalloc
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from typing import Iterable, List, Tuple
+
+import pandas as pd
+
+from decode_encode_answers import decode_qasrl
+from evaluate import match_arguments, score_matches, MATCHING_BACKENDS, MATCHING_BACKEND
+from evaluate_dataset import PredicateIndex, yield_paired_keys, write_alignment
+from interning import intern_columns
+from profiling import Profiler
+from synthetic_qasrl import generate_workload, write_workload
+
+# Times every stage of an evaluation run on synthetic workloads of increasing size.
+# Stages run one after the other on the output of the previous one:
+#   csv_read         pd.read_csv of the gold, system and sentence files
+#   decode           decode_qasrl of gold and system, and interning of their string columns
+#   pairing          indexing both datasets and building the Role lists of every paired predicate
+#   matching         one to one argument matching of every predicate (match_arguments)
+#   labeled_scoring  labelled and unlabelled counts of every predicate from its matches (score_matches)
+#   alignment        writing the .align.csv
+# With --memory, the memory held by the Role and Question objects of every gold predicate is also measured,
+# outside of the timed stages since tracing allocations slows everything down.
+BENCHMARK_VERSION = 2
+
+
+def run_benchmark(n_predicates: int, roles_per_predicate: float, spans_per_role: float, noise: float,
+                  overlap: float, seed: int, work_dir: str, matching_backend: str = None,
+                  measure_memory: bool = False) -> dict:
+    # A separate profiler from the global one, whose stages would overlap the ones timed here
+    timer = Profiler(enabled=True)
+    with timer.stage('generate'):
+        dfs = generate_workload(n_predicates, roles_per_predicate, spans_per_role, noise, overlap, seed)
+        gold_path, sys_path, sents_path = write_workload(work_dir, *dfs, name=f"synthetic_{n_predicates}")
+    del dfs
+
+    with timer.stage('csv_read'):
+        grt_df = pd.read_csv(gold_path)
+        sys_df = pd.read_csv(sys_path)
+        sents = pd.read_csv(sents_path)
+    with timer.stage('decode'):
+        grt_df = intern_columns(decode_qasrl(grt_df))
+        sys_df = intern_columns(decode_qasrl(sys_df))
+    with timer.stage('pairing'):
+        grt_index = PredicateIndex(grt_df)
+        sys_index = PredicateIndex(sys_df)
+        paired = [(key, sys_index.roles(key), grt_index.roles(key))
+                  for key in yield_paired_keys(sys_index, grt_index)]
+    with timer.stage('matching'):
+        grt_args = [set(arg for role in grt_roles for arg in role.arguments) for _, _, grt_roles in paired]
+        matches = [match_arguments(predicate_grt_args, set(arg for role in sys_roles for arg in role.arguments),
+                                   matching_backend)
+                   for (_, sys_roles, _), predicate_grt_args in zip(paired, grt_args)]
+    with timer.stage('labeled_scoring'):
+        for (key, sys_roles, grt_roles), predicate_matches, predicate_grt_args in zip(paired, matches, grt_args):
+            score_matches(sys_roles, grt_roles, predicate_matches, len(predicate_grt_args))
+    with timer.stage('alignment'):
+        sent_map = dict(zip(sents.qasrl_id, sents.tokens.apply(str.split)))
+        write_alignment(os.path.join(work_dir, f"synthetic_{n_predicates}.align.csv"),
+                        sys_index, grt_index, sent_map, matching_backend=matching_backend)
+
+    run = {'n_predicates': n_predicates,
+           'n_gold_rows': len(grt_df),
+           'n_sys_rows': len(sys_df),
+           'n_paired_predicates': len(paired),
+           'stages': timer.summary()['stages']}
+    if measure_memory:
+        del paired, matches, grt_args
+        run['role_memory'] = measure_role_memory(grt_index, list(grt_index.keys()))
+    return run
+
+
+def measure_role_memory(index: PredicateIndex, keys: Iterable[Tuple[str, int]]) -> dict:
+    # Bytes allocated for the roles of every predicate, along with their questions and argument tuples,
+    # while all of them are alive
+    tracemalloc.start()
+    roles = [index.roles(key) for key in keys]
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    n_roles = sum(len(predicate_roles) for predicate_roles in roles)
+    return {'n_roles': n_roles,
+            'allocated_bytes': allocated,
+            'bytes_per_role': allocated / n_roles if n_roles else 0.0}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(sizes: List[int], roles_per_predicate: float, spans_per_role: float, noise: float, overlap: float,
+         seed: int, out_path: str = None, work_dir: str = None, matching_backend: str = None,
+         measure_memory: bool = False):
+    config = {'roles_per_predicate': roles_per_predicate, 'spans_per_role': spans_per_role,
+              'noise': noise, 'overlap': overlap, 'seed': seed,
+              'matching_backend': matching_backend or MATCHING_BACKEND}
+    report = {'version': BENCHMARK_VERSION,
+              'created': datetime.now(timezone.utc).isoformat(),
+              'git_revision': git_revision(),
+              'python': platform.python_version(),
+              'pandas': pd.__version__,
+              'machine': platform.machine(),
+              'config': config,
+              'runs': []}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_predicates in sizes:
+            run = run_benchmark(n_predicates, roles_per_predicate, spans_per_role, noise, overlap, seed,
+                                work_dir or tmp_dir, matching_backend, measure_memory)
+            report['runs'].append(run)
+            stages = "  ".join(f"{name} {times['wall']:.2f}s" for name, times in run['stages'].items())
+            print(f"{n_predicates} predicates, {run['n_gold_rows']} gold rows: {stages}")
+            if measure_memory:
+                memory = run['role_memory']
+                print(f"  {memory['n_roles']} gold roles: {memory['allocated_bytes'] / 2 ** 20:.1f} MB, "
+                      f"{memory['bytes_per_role']:.0f} bytes per role")
+
+    if out_path is not None:
+        with open(out_path, "w", encoding="utf-8") as fout:
+            json.dump(report, fout, indent=2)
+        print(out_path)
+    return report
+
+
+if __name__ == "__main__":
+    ap = ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1264, 10000, 100000],
+                    help="Number of gold predicates of every run (1264 is the size of wikinews.dev, "
+                         "~340000 gives 1M gold rows)")
+    ap.add_argument("--roles", type=float, default=2.9, help="Mean number of roles per predicate")
+    ap.add_argument("--spans", type=float, default=1.15, help="Mean number of answer spans per role")
+    ap.add_argument("--noise", type=float, default=0.2)
+    ap.add_argument("--overlap", type=float, default=0.1)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--matcher", choices=MATCHING_BACKENDS, default=MATCHING_BACKEND)
+    ap.add_argument("--memory", action="store_true",
+                    help="Also measure the memory held by the Role and Question objects of the gold predicates")
+    ap.add_argument("--out", required=False, help="/path/to/benchmark_results.json")
+    ap.add_argument("--work_dir", required=False,
+                    help="Keep the generated CSVs in this directory instead of a temporary one")
+    args = ap.parse_args()
+    main(args.sizes, args.roles, args.spans, args.noise, args.overlap, args.seed, args.out, args.work_dir,
+         args.matcher, args.memory)
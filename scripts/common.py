@@ -1,3 +1,5 @@
+from sys import intern
+from functools import lru_cache
 from typing import Tuple, List, Set, Iterable
 
 Argument = Tuple[int, int]
@@ -6,16 +8,38 @@ QUESTION_FIELDS = ['wh', 'subj', 'obj', 'aux', 'prep', 'obj2', 'is_passive', 'is
 
 
 class Question:
+    # Slotted, with interned slot values and the hash of the text computed once:
+    # millions of questions are built while indexing a dataset.
+    # Questions are still equal, hashed and ordered by their text only.
+    __slots__ = ('text', 'wh', 'subj', 'obj', 'aux', 'prep', 'obj2', 'is_passive', 'is_negated',
+                 'paraphrase_id', '_hash')
+
     def __init__(self, **kwargs):
-        self.text = kwargs['text']
-        self.wh = kwargs['wh'].lower()
-        self.subj =kwargs['subj']
-        self.obj = kwargs['obj']
-        self.aux = kwargs['aux']
-        self.prep = kwargs['prep']
-        self.obj2 = kwargs['obj2']
+        # Inlined, these run for every role of a dataset
+        text, subj, obj = kwargs['text'], kwargs['subj'], kwargs['obj']
+        aux, prep, obj2 = kwargs['aux'], kwargs['prep'], kwargs['obj2']
+        self.text = intern(text) if type(text) is str else text
+        self.wh = lower_wh(kwargs['wh'])
+        self.subj = intern(subj) if type(subj) is str else subj
+        self.obj = intern(obj) if type(obj) is str else obj
+        self.aux = intern(aux) if type(aux) is str else aux
+        self.prep = intern(prep) if type(prep) is str else prep
+        self.obj2 = intern(obj2) if type(obj2) is str else obj2
         self.is_passive = kwargs['is_passive']
         self.is_negated = kwargs['is_negated']
+        # Integer id of the paraphrase class, assigned at load time (see paraphrases.ParaphraseClasses)
+        self.paraphrase_id = kwargs.get('paraphrase_id')
+        self._hash = hash(self.text)
+
+    def __getstate__(self):
+        # The hash is left out: str hashes are salted per process, so an unpickled question (e.g. in a spawned
+        # pool process) hashes its text again
+        return {slot: getattr(self, slot) for slot in self.__slots__ if slot != '_hash'}
+
+    def __setstate__(self, state):
+        for slot, value in state.items():
+            setattr(self, slot, value)
+        self._hash = hash(self.text)
 
     def __str__(self):
         return self.text
@@ -24,14 +48,21 @@ class Question:
         return self.text < other.text
 
     def __hash__(self):
-        return hash(self.text)
+        return self._hash
 
     def __eq__(self, other):
         return self.text == other.text
 
 
+@lru_cache(maxsize=None)
+def lower_wh(wh: str) -> str:
+    # A handful of distinct wh words, each is lowercased once
+    return intern(wh.lower())
+
 
 class Role:
+    __slots__ = ('question', 'arguments')
+
     def __init__(self, question: Question, arguments: Iterable[Tuple[Argument, ...]]):
         self.question = question
         self.arguments = tuple(arguments)
@@ -4,12 +4,14 @@ import pandas as pd
 from sklearn.utils import shuffle
 import os
 
+from interning import intern_columns
+
 
 def main(arbit_path: str):
-    df = pd.read_csv(arbit_path)
+    df = intern_columns(pd.read_csv(arbit_path))
     ids = df[['qasrl_id', 'verb_idx', 'assign_id']].drop_duplicates()
     ids = shuffle(ids)
-    single_assign_ids = ids.groupby(['qasrl_id', 'verb_idx']).head(1)
+    single_assign_ids = ids.groupby(['qasrl_id', 'verb_idx'], observed=True).head(1)
     selected_df = pd.merge(df, single_assign_ids, on=['qasrl_id', 'verb_idx', 'assign_id'])
     is_accepted = selected_df.answer_range.notnull()
     selected_df = selected_df[is_accepted].copy()
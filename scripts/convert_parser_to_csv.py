@@ -1,16 +1,40 @@
 import os
 from argparse import ArgumentParser
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
 import json
+from typing import Iterable, Iterator, List
 import pandas as pd
+from common import QUESTION_FIELDS
 from decode_encode_answers import encode_qasrl
 
-def load_records(path):
+SLOT_HEADERS = ['wh', 'aux', 'subj', 'obj', 'verb_slot_inflection',
+                'prep', 'obj2', 'is_passive', 'is_negated']
+CSV_COLUMNS = ['qasrl_id', 'verb_idx', 'verb', 'question', 'answer', 'answer_range'] + SLOT_HEADERS
+DEFAULT_BATCH_SIZE = 10000
+
+
+def iter_records(path) -> Iterator[dict]:
     with open(path, "r", encoding="utf-8") as fin:
-        records = [json.loads(line) for line in fin]
-        return records
+        for line in fin:
+            if line.strip():
+                yield json.loads(line)
 
 
 def yield_roles_from_parser(records, min_score):
+    for item in yield_scored_roles_from_parser(records):
+        span_scores = item.pop('span_scores')
+        is_kept = [score > min_score for score in span_scores]
+        if not any(is_kept):
+            continue
+        item['answer'] = [answer for answer, kept in zip(item['answer'], is_kept) if kept]
+        item['answer_range'] = [answer_range for answer_range, kept in zip(item['answer_range'], is_kept) if kept]
+        yield item
+
+
+def yield_scored_roles_from_parser(records):
+    # Every role with all of its spans, and the parser score of each span in span_scores
     for rec in records:
         qasrl_id = rec['qasrl_id']
         for verb in rec['verbs']:
@@ -19,41 +43,86 @@ def yield_roles_from_parser(records, min_score):
             for qa_pair in verb['qa_pairs']:
                 question = qa_pair['question']
                 slots = qa_pair['slots']
-                answer_ranges = [(span['start'], span['end']+1)
-                                 for span in qa_pair['spans']
-                                 if span['score'] > min_score]
-                answers = [span['text'] for span in qa_pair['spans']
-                           if span['score'] > min_score]
-                if not answer_ranges:
-                    continue
                 item = {
                     'qasrl_id': qasrl_id,
-                    'verb_index': predicate_idx,
+                    'verb_idx': predicate_idx,
                     'verb': predicate,
                     'question': question,
-                    'answer': answers,
-                    'answer_range': answer_ranges,
+                    'answer': [span['text'] for span in qa_pair['spans']],
+                    'answer_range': [(span['start'], span['end']+1) for span in qa_pair['spans']],
+                    'span_scores': [span['score'] for span in qa_pair['spans']],
                 }
                 item.update(slots)
                 yield item
 
 
+def parser_roles_frame(items: Iterable[dict], columns: List[str] = CSV_COLUMNS) -> pd.DataFrame:
+    # Parser roles as decode_qasrl returns them after a round trip through the CSV
+    parser_df = pd.DataFrame(list(items), columns=columns)
+    for field in QUESTION_FIELDS:
+        parser_df[field] = parser_df[field].fillna("")
+    return parser_df
+
+
+def batched(items: Iterable, batch_size: int) -> Iterator[list]:
+    items = iter(items)
+    while True:
+        batch = list(islice(items, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def roles_from_lines(lines: List[str], min_score: float) -> List[dict]:
+    records = (json.loads(line) for line in lines if line.strip())
+    return list(yield_roles_from_parser(records, min_score))
+
+
+def yield_parallel_role_batches(parser_path: str, min_score: float,
+                                batch_size: int, workers: int) -> Iterator[List[dict]]:
+    # Lines are parsed in chunks by a process pool, at most two chunks per process are in flight
+    # so memory does not grow with the size of the input, and chunks are yielded in input order.
+    with open(parser_path, "r", encoding="utf-8") as fin, Pool(workers) as pool:
+        pending = deque()
+        for lines in batched(fin, batch_size):
+            pending.append(pool.apply_async(roles_from_lines, (lines, min_score)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def write_csv_batches(batches: Iterable[List[dict]], out_path: str):
+    # Each batch is encoded and appended to the output, so only one batch is held in memory
+    n_rows = 0
+    with open(out_path, "w", encoding="utf-8", newline="") as fout:
+        for batch in batches:
+            if not batch:
+                continue
+            df = pd.DataFrame(batch, columns=CSV_COLUMNS)
+            df = encode_qasrl(df)
+            df.to_csv(fout, index=False, header=(n_rows == 0))
+            n_rows += len(df)
+        if not n_rows:
+            pd.DataFrame(columns=CSV_COLUMNS).to_csv(fout, index=False)
+    return n_rows
+
+
 def main(args):
-    records = load_records(args.parser_path)
-    records = list(yield_roles_from_parser(records, args.min_score))
-    df = pd.DataFrame(records)
-    slot_headers = ['wh', 'aux', 'subj', 'obj', 'verb_slot_inflection',
-                    'prep', 'obj2', 'is_passive', 'is_negated']
-    cols = ['qasrl_id', 'verb_idx', 'verb', 'question', 'answer', 'answer_range', 'wh'] + slot_headers
     out_path = os.path.splitext(args.parser_path)[0] + f".T_{args.min_score}.csv"
-    df = df[cols].copy()
-    df = encode_qasrl(df)
-    df[cols].to_csv(out_path, index=False, encoding="utf-8")
+    if args.workers > 1:
+        batches = yield_parallel_role_batches(args.parser_path, args.min_score, args.batch_size, args.workers)
+    else:
+        items = yield_roles_from_parser(iter_records(args.parser_path), args.min_score)
+        batches = batched(items, args.batch_size)
+    write_csv_batches(batches, out_path)
 
 
 if __name__ == "__main__":
     ap = ArgumentParser()
     ap.add_argument("parser_path")
     ap.add_argument("--min_score", default=0.0, type=float)
+    ap.add_argument("--batch_size", default=DEFAULT_BATCH_SIZE, type=int,
+                    help="Number of rows (or input lines when parsing in parallel) processed at a time")
+    ap.add_argument("--workers", default=1, type=int, help="Number of processes used to parse the input")
     main(ap.parse_args())
-
@@ -0,0 +1,229 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Callable, Dict
+
+import numpy as np
+import pandas as pd
+
+from decode_encode_answers import NO_RANGE, SPAN_SEPARATOR, decode_qasrl, decode_span_arrays
+from interning import INTERNED_COLUMNS, intern_codes, intern_columns
+from profiling import PROFILER
+
+# A decoded dataset is cached as a directory of flat .npy arrays next to the CSV:
+#   answer ranges: int32 span starts and ends, int64 row offsets and a NO_RANGE row mask
+#   answers: the ~!~ joined answer texts, dictionary encoded
+#   other text columns: int32 codes into a vocabulary of distinct values (ids are stored once),
+#       the columns of interning.INTERNED_COLUMNS are read back as categoricals of these codes
+#   numeric and boolean columns: the values themselves
+# The cache is rebuilt whenever the hash of the source file or the cache version changes.
+# Frames read from the cache are built from the mapped arrays without a Python object per row:
+# text columns are categoricals of their codes (answers stay ~!~ joined), and each answer range column
+# holds the row numbers of the cache, whose spans are found in the SpanArrays of qasrl_df.attrs[SPAN_ARRAYS].
+# Row selections, copies and groupbys keep attrs, PredicateIndex builds the argument tuples of a role
+# only when the role is built.
+CACHE_VERSION = 1
+CACHE_SUFFIX = ".qasrl_cache"
+META_FILE = "meta.json"
+SPAN_ARRAYS = "span_arrays"
+
+
+class SpanArrays:
+    # Spans of row i are (starts[j], ends[j]) for offsets[i] <= j < offsets[i+1]. Starts and ends are
+    # token indices, kept as lists of (mostly small, shared) ints since every role reads a slice of them.
+    def __init__(self, starts: np.ndarray, ends: np.ndarray, offsets: np.ndarray, is_no_range: np.ndarray):
+        self.starts = starts.tolist()
+        self.ends = ends.tolist()
+        self.offsets = np.asarray(offsets)
+        self.is_no_range = np.asarray(is_no_range)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def argument(self, row: int) -> tuple:
+        if self.is_no_range[row]:
+            return (NO_RANGE,)
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return tuple(zip(self.starts[start: end], self.ends[start: end]))
+
+
+def load_qasrl(csv_path: str, use_cache: bool = True,
+               read_fn: Callable[[str], pd.DataFrame] = pd.read_csv) -> pd.DataFrame:
+    if not use_cache:
+        return read_and_decode(csv_path, read_fn)
+
+    cache_path = get_cache_path(csv_path)
+    source_hash = file_hash(csv_path)
+    if is_cache_valid(cache_path, source_hash):
+        with PROFILER.stage('cache_read'):
+            return read_cache(cache_path)
+
+    # Answers are written to the cache straight from their encoded strings
+    qasrl_df = read_and_decode(csv_path, read_fn, decode_answers=False)
+    try:
+        with PROFILER.stage('cache_write'):
+            write_cache(qasrl_df, cache_path, source_hash)
+    except OSError as e:
+        print(f"Could not cache {csv_path}: {e}")
+        return read_and_decode(csv_path, read_fn)
+    # The first run gets the same frame as the ones that follow
+    with PROFILER.stage('cache_read'):
+        return read_cache(cache_path)
+
+
+def read_and_decode(csv_path: str, read_fn: Callable[[str], pd.DataFrame],
+                    decode_answers: bool = True) -> pd.DataFrame:
+    with PROFILER.stage('csv_read'):
+        qasrl_df = read_fn(csv_path)
+    with PROFILER.stage('decode'):
+        qasrl_df = decode_qasrl(qasrl_df, decode_answers=decode_answers)
+    with PROFILER.stage('intern'):
+        return intern_columns(qasrl_df)
+
+
+def get_cache_path(csv_path: str) -> str:
+    return os.path.splitext(csv_path)[0] + CACHE_SUFFIX
+
+
+def file_hash(path: str) -> str:
+    sha = hashlib.sha1()
+    with open(path, "rb") as fin:
+        for block in iter(lambda: fin.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def is_cache_valid(cache_path: str, source_hash: str) -> bool:
+    meta_path = os.path.join(cache_path, META_FILE)
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, "r", encoding="utf-8") as fin:
+        meta = json.load(fin)
+    return meta.get('version') == CACHE_VERSION and meta.get('source_hash') == source_hash
+
+
+def column_kind(qasrl_df: pd.DataFrame, col: str) -> str:
+    if "answer_range" in col:
+        return "ranges"
+    if "answer" in col:
+        return "answers"
+    if pd.api.types.is_numeric_dtype(qasrl_df[col]) or pd.api.types.is_bool_dtype(qasrl_df[col]):
+        return "values"
+    return "codes"
+
+
+def write_cache(qasrl_df: pd.DataFrame, cache_path: str, source_hash: str):
+    tmp_path = f"{cache_path}.tmp{os.getpid()}"
+    os.makedirs(tmp_path, exist_ok=True)
+    columns = []
+    for col_idx, col in enumerate(qasrl_df.columns):
+        kind = column_kind(qasrl_df, col)
+        prefix = os.path.join(tmp_path, f"col{col_idx}")
+        if kind == "ranges":
+            write_ranges(qasrl_df[col], prefix)
+        elif kind == "answers":
+            write_codes(qasrl_df[col] if is_encoded(qasrl_df[col]) else qasrl_df[col].apply(SPAN_SEPARATOR.join),
+                        prefix)
+        elif kind == "values":
+            np.save(f"{prefix}.values.npy", qasrl_df[col].values)
+        else:
+            write_codes(qasrl_df[col], prefix)
+        columns.append({'name': col, 'kind': kind})
+
+    meta = {'version': CACHE_VERSION, 'source_hash': source_hash,
+            'n_rows': len(qasrl_df), 'columns': columns}
+    with open(os.path.join(tmp_path, META_FILE), "w", encoding="utf-8") as fout:
+        json.dump(meta, fout)
+    if os.path.exists(cache_path):
+        shutil.rmtree(cache_path)
+    os.replace(tmp_path, cache_path)
+
+
+def write_codes(values: pd.Series, prefix: str):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes, vocab = values.cat.codes.values, values.cat.categories
+    else:
+        codes, vocab = pd.factorize(values)
+    np.save(f"{prefix}.codes.npy", codes.astype(np.int32))
+    # numpy scalars are converted so that bools and ints keep their type in JSON
+    vocab = [v.item() if isinstance(v, np.generic) else v for v in vocab]
+    with open(f"{prefix}.vocab.json", "w", encoding="utf-8") as fout:
+        # dumps encodes in C, dump streams through the Python encoder
+        fout.write(json.dumps(vocab))
+
+
+def is_encoded(values: pd.Series) -> bool:
+    return len(values) > 0 and isinstance(values.iloc[0], str)
+
+
+def write_ranges(arguments: pd.Series, prefix: str):
+    if is_encoded(arguments):
+        starts, ends, offsets, no_range_values = decode_span_arrays(arguments)
+        is_no_range = np.zeros(len(arguments), dtype=bool)
+        is_no_range[no_range_values.index] = True
+        write_span_arrays(starts, ends, offsets, is_no_range, prefix)
+        return
+    is_no_range = np.array([arg[0] == NO_RANGE for arg in arguments], dtype=bool)
+    n_spans = np.array([0 if no_range else len(arg)
+                        for arg, no_range in zip(arguments, is_no_range)], dtype=np.int64)
+    offsets = np.zeros(len(arguments) + 1, dtype=np.int64)
+    np.cumsum(n_spans, out=offsets[1:])
+    spans = np.array([span for arg, no_range in zip(arguments, is_no_range)
+                      if not no_range for span in arg], dtype=np.int32).reshape(-1, 2)
+    write_span_arrays(spans[:, 0], spans[:, 1], offsets, is_no_range, prefix)
+
+
+def write_span_arrays(starts: np.ndarray, ends: np.ndarray, offsets: np.ndarray, is_no_range: np.ndarray,
+                      prefix: str):
+    np.save(f"{prefix}.starts.npy", np.ascontiguousarray(starts, dtype=np.int32))
+    np.save(f"{prefix}.ends.npy", np.ascontiguousarray(ends, dtype=np.int32))
+    np.save(f"{prefix}.offsets.npy", offsets)
+    np.save(f"{prefix}.no_range.npy", is_no_range)
+
+
+def read_cache(cache_path: str) -> pd.DataFrame:
+    with open(os.path.join(cache_path, META_FILE), "r", encoding="utf-8") as fin:
+        meta = json.load(fin)
+
+    data: Dict[str, object] = {}
+    span_arrays: Dict[str, SpanArrays] = {}
+    for col_idx, column in enumerate(meta['columns']):
+        col, kind = column['name'], column['kind']
+        prefix = os.path.join(cache_path, f"col{col_idx}")
+        if kind == "ranges":
+            span_arrays[col] = read_ranges(prefix)
+            data[col] = np.arange(meta['n_rows'], dtype=np.int64)
+        elif kind == "answers":
+            codes, vocab = read_code_arrays(prefix)
+            data[col] = pd.Categorical.from_codes(codes, categories=pd.Index(vocab, dtype=object))
+        elif kind == "values":
+            data[col] = np.load(f"{prefix}.values.npy", mmap_mode="r", allow_pickle=False)
+        elif col in INTERNED_COLUMNS:
+            data[col] = intern_codes(*read_code_arrays(prefix))
+        else:
+            data[col] = read_codes(prefix)
+    qasrl_df = pd.DataFrame(data, columns=[column['name'] for column in meta['columns']])
+    qasrl_df.attrs[SPAN_ARRAYS] = span_arrays
+    return qasrl_df
+
+
+def read_codes(prefix: str) -> np.ndarray:
+    codes, vocab = read_code_arrays(prefix)
+    # code -1 marks missing values and maps to the NaN appended at the end of the vocabulary
+    vocab = np.append(vocab, np.nan)
+    return vocab[codes]
+
+
+def read_code_arrays(prefix: str):
+    codes = np.load(f"{prefix}.codes.npy", mmap_mode="r")
+    with open(f"{prefix}.vocab.json", "r", encoding="utf-8") as fin:
+        vocab = json.load(fin)
+    return codes, np.array(vocab, dtype=object)
+
+
+def read_ranges(prefix: str) -> SpanArrays:
+    return SpanArrays(np.load(f"{prefix}.starts.npy", mmap_mode="r"),
+                      np.load(f"{prefix}.ends.npy", mmap_mode="r"),
+                      np.load(f"{prefix}.offsets.npy", mmap_mode="r"),
+                      np.load(f"{prefix}.no_range.npy", mmap_mode="r"))
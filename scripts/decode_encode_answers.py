@@ -1,3 +1,6 @@
+from itertools import compress
+
+import numpy as np
 import pandas as pd
 from typing import List, Tuple
 from common import Argument, QUESTION_FIELDS
@@ -54,7 +57,67 @@ def decode_argument(arg_str: str) -> List[Argument]:
     return ranges
 
 
-def decode_qasrl(qasrl_df: pd.DataFrame) -> pd.DataFrame:
+def decode_span_arrays(arg_strs: pd.Series) -> Tuple[np.ndarray, np.ndarray, np.ndarray, pd.Series]:
+    # Splits a column of encoded arguments into flat span start and end arrays,
+    # spans of row i are found between offsets[i] and offsets[i+1].
+    # NO_RANGE rows have no spans, their split values are returned as is.
+    arg_strs = arg_strs.values.tolist()
+    is_no_range = np.array([arg_str.startswith(NO_RANGE) for arg_str in arg_strs], dtype=bool)
+    # NO_RANGE is only recognized as the first split value
+    is_no_range[is_no_range] = [arg_str.split(SPAN_SEPARATOR)[0] == NO_RANGE
+                                for arg_str in compress(arg_strs, is_no_range)]
+    span_strs = list(compress(arg_strs, ~is_no_range))
+    n_spans = np.zeros(len(arg_strs), dtype=np.int64)
+    n_spans[~is_no_range] = [arg_str.count(SPAN_SEPARATOR) + 1 for arg_str in span_strs]
+    offsets = np.zeros(len(arg_strs) + 1, dtype=np.int64)
+    np.cumsum(n_spans, out=offsets[1:])
+
+    # All spans of the column are parsed at once as a flat sequence of start, end numbers
+    bounds = SPAN_SEPARATOR.join(span_strs).replace(":", SPAN_SEPARATOR).split(SPAN_SEPARATOR) if span_strs else []
+    if len(bounds) == 2 * offsets[-1]:
+        bounds = np.array(bounds, dtype=np.int64)
+        starts, ends = bounds[0::2], bounds[1::2]
+    else:
+        # Some span is not a plain start:end pair, fall back to decoding it span by span
+        spans = [decode_span(span_str) for arg_str in span_strs for span_str in arg_str.split(SPAN_SEPARATOR)]
+        spans = np.array(spans, dtype=np.int64).reshape(-1, 2)
+        starts, ends = spans[:, 0], spans[:, 1]
+    no_range_values = pd.Series([arg_str.split(SPAN_SEPARATOR) for arg_str in compress(arg_strs, is_no_range)],
+                                index=np.flatnonzero(is_no_range), dtype=object)
+    return starts, ends, offsets, no_range_values
+
+
+def arguments_from_span_arrays(starts: np.ndarray, ends: np.ndarray, offsets: np.ndarray,
+                               no_range_values: pd.Series) -> List[list]:
+    spans = list(zip(starts.tolist(), ends.tolist()))
+    arguments = [spans[start: end] for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+    for row_idx, value in no_range_values.items():
+        arguments[row_idx] = value
+    return arguments
+
+
+def decode_arguments(arg_strs: pd.Series) -> pd.Series:
+    arguments = arguments_from_span_arrays(*decode_span_arrays(arg_strs))
+    return pd.Series(arguments, index=arg_strs.index, dtype=object)
+
+
+def encode_arguments(arguments: pd.Series) -> List[str]:
+    # Same output as applying encode_argument, without the per-row apply and function calls
+    format_span = "{0[0]}:{0[1]}".format
+    return [NO_RANGE if arg[0] == NO_RANGE else SPAN_SEPARATOR.join(map(format_span, arg))
+            for arg in arguments.values.tolist()]
+
+
+def encode_span_arrays(starts: np.ndarray, ends: np.ndarray, offsets: np.ndarray,
+                       is_no_range: np.ndarray) -> List[str]:
+    # The inverse of decode_span_arrays, all spans are formatted at once and then joined per row
+    span_strs = list(map(":".join, zip(map(str, starts.tolist()), map(str, ends.tolist()))))
+    return [NO_RANGE if no_range else SPAN_SEPARATOR.join(span_strs[start: end])
+            for start, end, no_range in zip(offsets[:-1].tolist(), offsets[1:].tolist(), is_no_range.tolist())]
+
+
+def decode_qasrl(qasrl_df: pd.DataFrame, vectorized: bool = True, decode_answers: bool = True) -> pd.DataFrame:
+    # Without decode_answers, rows are filtered and question slots filled, but answers stay encoded
     # WHY WHY WHY WE HAVE NULLS??? (see below why)
     qasrl_df.dropna(subset=['qasrl_id', 'verb_idx', 'question'], inplace=True)
     cols = set(qasrl_df.columns)
@@ -74,10 +137,18 @@ def decode_qasrl(qasrl_df: pd.DataFrame) -> pd.DataFrame:
     if answer_cols:
         qasrl_df.dropna(subset=answer_cols, inplace=True)
 
+    if not decode_answers:
+        answer_cols, answer_range_cols = set(), set()
     for c in answer_cols:
-        qasrl_df[c] = qasrl_df[c].apply(lambda a: a.split(SPAN_SEPARATOR))
+        if vectorized:
+            qasrl_df[c] = [a.split(SPAN_SEPARATOR) for a in qasrl_df[c].values.tolist()]
+        else:
+            qasrl_df[c] = qasrl_df[c].apply(lambda a: a.split(SPAN_SEPARATOR))
     for c in answer_range_cols:
-        qasrl_df[c] = qasrl_df[c].apply(decode_argument)
+        if vectorized:
+            qasrl_df[c] = decode_arguments(qasrl_df[c])
+        else:
+            qasrl_df[c] = qasrl_df[c].apply(decode_argument)
 
     for c in QUESTION_FIELDS:
         if c in qasrl_df:
@@ -86,15 +157,21 @@ def decode_qasrl(qasrl_df: pd.DataFrame) -> pd.DataFrame:
     return qasrl_df
 
 
-def encode_qasrl(qasrl_df):
+def encode_qasrl(qasrl_df, vectorized: bool = True):
     for_csv = qasrl_df.copy()
     cols = set(qasrl_df.columns)
     answer_range_cols = set([col for col in cols if "answer_range" in col])
     answer_cols = set([col for col in cols  if "answer" in col]) - answer_range_cols
 
     for c in answer_range_cols:
-        for_csv[c] = for_csv[c].apply(encode_argument)
+        if vectorized:
+            for_csv[c] = encode_arguments(for_csv[c])
+        else:
+            for_csv[c] = for_csv[c].apply(encode_argument)
     for c in answer_cols:
-        for_csv[c] = for_csv[c].apply(encode_argument_text)
+        if vectorized:
+            for_csv[c] = [SPAN_SEPARATOR.join(a) for a in for_csv[c].values.tolist()]
+        else:
+            for_csv[c] = for_csv[c].apply(encode_argument_text)
     return for_csv
 
@@ -1,11 +1,20 @@
 from itertools import combinations, product
-from typing import List, Dict, Any, Tuple, Iterable, Set
-from common import Role, Argument
-from paraphrases import get_paraphrase_score
+from typing import List, Dict, Any, Tuple, Iterable, Set, Sequence, Callable
+from common import Role, Argument, Question
+from paraphrases import paraphrase_class_id
+from profiling import PROFILER
+import numpy as np
 import networkx as nx
 from networkx.algorithms.matching import max_weight_matching
+from scipy.optimize import linear_sum_assignment
 
 MATCH_IOU_THRESHOLD = 0.5
+# "assignment" solves the bipartite matching directly on the IoU matrix,
+# "networkx" runs the general max_weight_matching and is kept as a reference implementation.
+# Both find a maximum cardinality matching of maximum total IoU, with the same unlabeled counts, but when
+# several matchings tie they may pair different spans, so labeled and role counts can differ slightly.
+MATCHING_BACKENDS = ('assignment', 'networkx')
+MATCHING_BACKEND = 'assignment'
 
 
 class Metrics:
@@ -48,11 +57,46 @@ def joint_len(arg1: Argument, arg2: Argument):
     return joint
 
 
+def to_span_arrays(args: Sequence[Argument]) -> Tuple[np.ndarray, np.ndarray]:
+    spans = np.array(args, dtype=np.int64).reshape(-1, 2)
+    return spans[:, 0], spans[:, 1]
+
+
+def iou_matrix(starts1: np.ndarray, ends1: np.ndarray,
+               starts2: np.ndarray, ends2: np.ndarray) -> np.ndarray:
+    # Scores all pairs of spans at once, rows follow the first span set and columns the second.
+    return elementwise_iou(starts1[:, None], ends1[:, None], starts2[None, :], ends2[None, :])
+
+
+def elementwise_iou(starts1: np.ndarray, ends1: np.ndarray,
+                    starts2: np.ndarray, ends2: np.ndarray) -> np.ndarray:
+    joint = np.minimum(ends1, ends2) - np.maximum(starts1, starts2)
+    np.maximum(joint, 0, out=joint)
+    union = (ends1 - starts1) + (ends2 - starts2) - joint
+    # Two empty spans have an empty union, their score is NaN and never passes a threshold
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return joint / union
+
+
+def span_iou_matrix(args1: Sequence[Argument], args2: Sequence[Argument]) -> np.ndarray:
+    return iou_matrix(*to_span_arrays(args1), *to_span_arrays(args2))
+
+
 def get_overlap_arguments(grt_items, sys_items, scoring_fn, threshold):
     # Sorting is important to make comparison invariant
     # to order of iteration for the greedy matcher
     sys_items = sorted(sys_items)
     grt_items = sorted(grt_items)
+    if scoring_fn is iou:
+        scores = span_iou_matrix(sys_items, grt_items)
+        sys_indices, grt_indices = np.nonzero(scores >= threshold)
+        if PROFILER.enabled:
+            PROFILER.count('span_pairs_scored', scores.size)
+            PROFILER.count('candidate_matches', len(sys_indices))
+        return [(sys_items[sys_idx], grt_items[grt_idx], score)
+                for sys_idx, grt_idx, score in zip(sys_indices.tolist(), grt_indices.tolist(),
+                                                   scores[sys_indices, grt_indices].tolist())]
+
     all_pairs = ((sys_item, grt_item, scoring_fn(sys_item, grt_item))
                  for sys_item, grt_item in product(sys_items, grt_items))
 
@@ -70,6 +114,10 @@ def align_one_to_one(matches: List[Tuple[Any, Any, float]]) -> Dict[Any, Any]:
         sys_arg = f"sys_{sys_arg[0]}:{sys_arg[1]}"
         grt_arg = f"grt_{grt_arg[0]}:{grt_arg[1]}"
         bipartite.add_edge(sys_arg, grt_arg, weight=score)
+    if PROFILER.enabled:
+        PROFILER.count('matching_graphs')
+        PROFILER.count('matching_graph_nodes', bipartite.number_of_nodes())
+        PROFILER.count('matching_graph_edges', bipartite.number_of_edges())
     max_alignment = max_weight_matching(bipartite, maxcardinality=True)
     sys_to_grt = {}
     for arg_1, arg_2 in max_alignment:
@@ -80,24 +128,113 @@ def align_one_to_one(matches: List[Tuple[Any, Any, float]]) -> Dict[Any, Any]:
     return sys_to_grt
 
 
+def align_matrix_one_to_one(weights: np.ndarray, is_candidate: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Maximum cardinality matching with maximum weight among the candidate cells of a weight matrix.
+    # Returns the row and column indices of the aligned pairs.
+    is_row_used = is_candidate.any(axis=1)
+    is_col_used = is_candidate.any(axis=0)
+    # Fast path: when no two candidates share a row or a column every candidate is aligned
+    if is_candidate.sum(axis=1).max(initial=0) <= 1 and is_candidate.sum(axis=0).max(initial=0) <= 1:
+        return np.nonzero(is_candidate)
+
+    rows = np.flatnonzero(is_row_used)
+    cols = np.flatnonzero(is_col_used)
+    sub_candidate = is_candidate[np.ix_(rows, cols)]
+    sub_weights = np.where(sub_candidate, weights[np.ix_(rows, cols)], 0.0)
+    # Every candidate edge gets a bonus larger than the weight of any matching,
+    # so a larger matching always beats a heavier but smaller one.
+    bonus = min(sub_weights.shape) * max(sub_weights.max(), 1.0) + 1.0
+    sub_weights = np.where(sub_candidate, sub_weights + bonus, 0.0)
+    if PROFILER.enabled:
+        PROFILER.count('matching_graphs')
+        PROFILER.count('matching_graph_nodes', len(rows) + len(cols))
+        PROFILER.count('matching_graph_edges', int(sub_candidate.sum()))
+    row_indices, col_indices = linear_sum_assignment(sub_weights, maximize=True)
+    is_aligned = sub_candidate[row_indices, col_indices]
+    return rows[row_indices[is_aligned]], cols[col_indices[is_aligned]]
+
+
 def consolidate_by_overlap(args: Iterable[Argument], scoring_fn, threshold):
-    g = nx.Graph()
-    g.add_nodes_from(args)
-    g.add_edges_from((arg_1, arg_2)
-                     for arg_1, arg_2 in combinations(args, r=2)
-                     if scoring_fn(arg_1, arg_2) >= threshold)
-
-    components = nx.connected_components(g)
-    representatives = [next(iter(component)) for component in components]
+    # Groups arguments that are connected by a chain of overlaps and keeps one argument per group.
+    # Arguments are sorted first, so each group is represented by its smallest argument
+    # and groups are returned in the order of their representatives.
+    args = sorted(args)
+    if scoring_fn is iou:
+        overlapping_pairs = get_overlapping_span_pairs(args, threshold)
+    else:
+        overlapping_pairs = ((idx_1, idx_2)
+                             for idx_1, idx_2 in combinations(range(len(args)), r=2)
+                             if scoring_fn(args[idx_1], args[idx_2]) >= threshold)
+
+    return group_representatives(args, overlapping_pairs)
+
+
+def consolidate_scored(sorted_args: List[Argument], is_overlap: np.ndarray) -> List[Argument]:
+    # Same groups as consolidate_by_overlap, from a precomputed matrix of overlapping pairs
+    idx_1, idx_2 = np.nonzero(np.triu(is_overlap, k=1))
+    return group_representatives(sorted_args, zip(idx_1.tolist(), idx_2.tolist()))
+
+
+def group_representatives(args: List[Argument], overlapping_pairs: Iterable[Tuple[int, int]]) -> List[Argument]:
+    parents = list(range(len(args)))
+    for idx_1, idx_2 in overlapping_pairs:
+        root_1, root_2 = find_root(parents, idx_1), find_root(parents, idx_2)
+        if root_1 != root_2:
+            # the smaller index stays the root, which makes it the representative of the group
+            parents[max(root_1, root_2)] = min(root_1, root_2)
+
+    representatives = [arg for arg_idx, arg in enumerate(args)
+                       if find_root(parents, arg_idx) == arg_idx]
+    if PROFILER.enabled:
+        PROFILER.count('consolidated_args', len(args) - len(representatives))
     return representatives
 
 
+def find_root(parents: List[int], idx: int) -> int:
+    while parents[idx] != idx:
+        parents[idx] = parents[parents[idx]]
+        idx = parents[idx]
+    return idx
+
+
+def get_overlapping_span_pairs(sorted_args: List[Argument], threshold) -> Iterable[Tuple[int, int]]:
+    # Sweep over spans sorted by start and score only the pairs that can reach the threshold.
+    # For a span a and a later span b, IoU(a, b) <= (a.end - b.start) / len(a),
+    # so b has to start at or before a.end - threshold * len(a).
+    starts, ends = to_span_arrays(sorted_args)
+    n_args = len(sorted_args)
+    if threshold > 0:
+        reach = ends - threshold * (ends - starts)
+        last_candidates = np.searchsorted(starts, reach + 1e-9, side='right')
+    else:
+        last_candidates = np.full(n_args, n_args)
+    n_candidates = np.maximum(last_candidates - np.arange(n_args) - 1, 0)
+    left = np.repeat(np.arange(n_args), n_candidates)
+    offsets = np.arange(left.size) - np.repeat(np.cumsum(n_candidates) - n_candidates, n_candidates)
+    right = left + 1 + offsets
+    scores = elementwise_iou(starts[left], ends[left], starts[right], ends[right])
+    is_overlap = scores >= threshold
+    return zip(left[is_overlap].tolist(), right[is_overlap].tolist())
+
+
 def match_arguments(grt_args: Set[Argument],
-                    sys_args: Set[Argument]):
-    matches = get_overlap_arguments(grt_args, sys_args, iou, MATCH_IOU_THRESHOLD )
-    sys_to_grt_arg = align_one_to_one(matches)
+                    sys_args: Set[Argument],
+                    matching_backend: str = None):
+    matching_backend = matching_backend or MATCHING_BACKEND
+    if matching_backend == 'networkx':
+        matches = get_overlap_arguments(grt_args, sys_args, iou, MATCH_IOU_THRESHOLD )
+        sys_to_grt_arg = align_one_to_one(matches)
+        matched_sys_args = set(m[0] for m in matches)
+    elif matching_backend == 'assignment':
+        sys_items = sorted(sys_args)
+        grt_items = sorted(grt_args)
+        scores = span_iou_matrix(sys_items, grt_items)
+        if PROFILER.enabled:
+            PROFILER.count('span_pairs_scored', scores.size)
+        return match_scored_arguments(sys_items, grt_items, scores, MATCH_IOU_THRESHOLD)
+    else:
+        raise ValueError(f"Unknown matching backend: {matching_backend}")
 
-    matched_sys_args = set(m[0] for m in matches)
     unmatched_sys_args = sys_args - matched_sys_args
     unmatched_grt_args = set(sys_to_grt_arg.values()) - set(grt_args)
     # This extension is used to evaluate redundant datasets
@@ -105,36 +242,168 @@ def match_arguments(grt_args: Set[Argument],
     return sys_to_grt_arg, unmatched_sys_args_consolidated, unmatched_grt_args
 
 
+def match_scored_arguments(sys_items: List[Argument], grt_items: List[Argument], scores: np.ndarray,
+                           threshold: float, sys_scores: np.ndarray = None):
+    # Matching of the assignment backend from the IoU matrix of the sorted system and gold arguments.
+    # Unmatched system arguments are consolidated with the IoU matrix of the system arguments
+    # with themselves when it is given, so a matrix computed once can serve several thresholds.
+    is_candidate = scores >= threshold
+    if PROFILER.enabled:
+        PROFILER.count('candidate_matches', int(is_candidate.sum()))
+    sys_indices, grt_indices = align_matrix_one_to_one(scores, is_candidate)
+    sys_to_grt_arg = {sys_items[sys_idx]: grt_items[grt_idx]
+                      for sys_idx, grt_idx in zip(sys_indices.tolist(), grt_indices.tolist())}
+    unmatched_indices = np.flatnonzero(~is_candidate.any(axis=1))
+    unmatched_sys_args = [sys_items[sys_idx] for sys_idx in unmatched_indices.tolist()]
+    # This extension is used to evaluate redundant datasets
+    if sys_scores is None:
+        unmatched_sys_args_consolidated = consolidate_by_overlap(unmatched_sys_args, iou, threshold)
+    else:
+        is_overlap = sys_scores[np.ix_(unmatched_indices, unmatched_indices)] >= threshold
+        unmatched_sys_args_consolidated = consolidate_scored(unmatched_sys_args, is_overlap)
+    unmatched_grt_args = set(sys_to_grt_arg.values()) - set(grt_items)
+    return sys_to_grt_arg, unmatched_sys_args_consolidated, unmatched_grt_args
+
+
 def evaluate(sys_roles: List[Role],
-             grt_roles: List[Role]):
+             grt_roles: List[Role],
+             matching_backend: str = None,
+             paraphrase_fn: Callable[[Question, Question], bool] = None):
 
     # remove duplicates from unlabelled and labeled arguments
     sys_args = set(arg for role in sys_roles for arg in role.arguments)
     grt_args = set(arg for role in grt_roles for arg in role.arguments)
     # get arguments with high overlap
-    sys_to_grt_arg, unmatched_sys_args, unmatched_grt_args = match_arguments(grt_args, sys_args)
+    if PROFILER.enabled:
+        PROFILER.count('predicates')
+    with PROFILER.stage('matching'):
+        matches = match_arguments(grt_args, sys_args, matching_backend)
+    with PROFILER.stage('labeled_scoring'):
+        return score_matches(sys_roles, grt_roles, matches, len(grt_args), paraphrase_fn)
+
+
+def score_matches(sys_roles: List[Role],
+                  grt_roles: List[Role],
+                  matches: Tuple[Dict[Argument, Argument], List[Argument], List[Argument]],
+                  n_grt_args: int,
+                  paraphrase_fn: Callable[[Question, Question], bool] = None):
+    # Counts of a predicate from the argument matches of match_arguments
+    sys_to_grt_arg, unmatched_sys_args, _ = matches
+    sys_arg_questions = index_questions_by_argument(sys_roles)
+    grt_arg_questions = index_questions_by_argument(grt_roles)
+    return score_alignment(sys_to_grt_arg, unmatched_sys_args, n_grt_args, len(grt_roles),
+                           sys_arg_questions, grt_arg_questions, paraphrase_fn)
+
 
+def evaluate_thresholds(sys_roles: List[Role],
+                        grt_roles: List[Role],
+                        thresholds: Sequence[float],
+                        paraphrase_fn: Callable[[Question, Question], bool] = None) -> List[Tuple[Metrics, ...]]:
+    # Same as evaluate with the assignment backend for every threshold, with the IoU matrices
+    # and the question indices computed once and only the matching repeated per threshold.
+    sys_items = sorted(set(arg for role in sys_roles for arg in role.arguments))
+    grt_items = sorted(set(arg for role in grt_roles for arg in role.arguments))
+    scores = span_iou_matrix(sys_items, grt_items)
+    sys_scores = span_iou_matrix(sys_items, sys_items)
+    if PROFILER.enabled:
+        PROFILER.count('predicates')
+        PROFILER.count('span_pairs_scored', scores.size + sys_scores.size)
+    sys_arg_questions = index_questions_by_argument(sys_roles)
+    grt_arg_questions = index_questions_by_argument(grt_roles)
+
+    all_metrics = []
+    for threshold in thresholds:
+        sys_to_grt_arg, unmatched_sys_args, _ = match_scored_arguments(sys_items, grt_items, scores,
+                                                                       threshold, sys_scores)
+        all_metrics.append(score_alignment(sys_to_grt_arg, unmatched_sys_args, len(grt_items), len(grt_roles),
+                                           sys_arg_questions, grt_arg_questions, paraphrase_fn))
+    return all_metrics
+
+
+def evaluate_score_thresholds(sys_roles: List[Role],
+                              sys_span_scores: List[Sequence[float]],
+                              grt_roles: List[Role],
+                              min_scores: Sequence[float],
+                              paraphrase_fn: Callable[[Question, Question], bool] = None) -> List[Tuple[Metrics, ...]]:
+    # Same as evaluate with the assignment backend for every min_score, after keeping only the system
+    # arguments scored above it (sys_span_scores holds one score per argument of each system role).
+    # The IoU matrices are computed once over all the system arguments, and sliced for each min_score.
+    sys_items = sorted(set(arg for role in sys_roles for arg in role.arguments))
+    grt_items = sorted(set(arg for role in grt_roles for arg in role.arguments))
+    item_indices = {arg: item_idx for item_idx, arg in enumerate(sys_items)}
+    # An argument is kept as long as one of its occurrences is
+    best_scores = np.full(len(sys_items), -np.inf)
+    for role, span_scores in zip(sys_roles, sys_span_scores):
+        for arg, score in zip(role.arguments, span_scores):
+            item_idx = item_indices[arg]
+            best_scores[item_idx] = max(best_scores[item_idx], score)
+    scores = span_iou_matrix(sys_items, grt_items)
+    sys_scores = span_iou_matrix(sys_items, sys_items)
+    if PROFILER.enabled:
+        PROFILER.count('predicates')
+        PROFILER.count('span_pairs_scored', scores.size + sys_scores.size)
+    grt_arg_questions = index_questions_by_argument(grt_roles)
+
+    all_metrics = []
+    for min_score in min_scores:
+        kept_indices = np.flatnonzero(best_scores > min_score)
+        kept_items = [sys_items[item_idx] for item_idx in kept_indices.tolist()]
+        kept_roles = [Role(role.question, tuple(arg for arg, score in zip(role.arguments, span_scores)
+                                                if score > min_score))
+                      for role, span_scores in zip(sys_roles, sys_span_scores)]
+        sys_arg_questions = index_questions_by_argument(kept_roles)
+        sys_to_grt_arg, unmatched_sys_args, _ = match_scored_arguments(
+            kept_items, grt_items, scores[kept_indices], MATCH_IOU_THRESHOLD,
+            sys_scores[np.ix_(kept_indices, kept_indices)])
+        all_metrics.append(score_alignment(sys_to_grt_arg, unmatched_sys_args, len(grt_items), len(grt_roles),
+                                           sys_arg_questions, grt_arg_questions, paraphrase_fn))
+    return all_metrics
+
+
+def score_alignment(sys_to_grt_arg: Dict[Argument, Argument],
+                    unmatched_sys_args: Sequence[Argument],
+                    n_grt_args: int,
+                    n_grt_roles: int,
+                    sys_arg_questions: Dict[Argument, Question],
+                    grt_arg_questions: Dict[Argument, Question],
+                    paraphrase_fn: Callable[[Question, Question], bool] = None) -> Tuple[Metrics, Metrics, Metrics]:
     n_unlabel_tp = len(sys_to_grt_arg)
     n_unlabel_fp = len(unmatched_sys_args)
-    n_unlabel_fn = len(grt_args) - n_unlabel_tp
+    n_unlabel_fn = n_grt_args - n_unlabel_tp
     unlabelled_arg_metrics = Metrics(n_unlabel_tp, n_unlabel_fp, n_unlabel_fn)
 
-    sys_qna = set((role.question, arg) for role in sys_roles for arg in role.arguments)
-    grt_qna = set((role.question, arg) for role in grt_roles for arg in role.arguments)
     n_label_tp, n_label_fp, n_label_fn = n_unlabel_tp, n_unlabel_fp, n_unlabel_fn
     matched_grt_roles = set()
     for sys_arg, grt_arg in sys_to_grt_arg.items():
-        sys_q = next(q for (q, a) in sys_qna if a == sys_arg)
-        grt_q = next(q for q, a in grt_qna if a == grt_arg)
-
+        # A span may answer several questions of the same predicate. Each side is labeled by a single one,
+        # the question with the smallest text, so extra questions on a span are not extra chances to match.
+        sys_q = sys_arg_questions[sys_arg]
+        grt_q = grt_arg_questions[grt_arg]
         matched_grt_roles.add(grt_q)
-        if not get_paraphrase_score(sys_q, grt_q):
+        if paraphrase_fn is None:
+            # paraphrases share a class id, labels are compared as integers
+            is_label_match = paraphrase_class_id(sys_q) == paraphrase_class_id(grt_q)
+        else:
+            is_label_match = paraphrase_fn(sys_q, grt_q)
+        if not is_label_match:
             n_label_tp -= 1
             n_label_fp += 1
             n_label_fn += 1
     labeled_arg_metrics = Metrics(n_label_tp, n_label_fp, n_label_fn)
 
     n_unlabel_role_tp = len(matched_grt_roles)
-    n_unlabel_role_fn = len(grt_roles) - n_unlabel_role_tp
+    n_unlabel_role_fn = n_grt_roles - n_unlabel_role_tp
     role_metrics = Metrics(n_unlabel_role_tp, 0, n_unlabel_role_fn)
     return unlabelled_arg_metrics, labeled_arg_metrics, role_metrics
+
+
+def index_questions_by_argument(roles: List[Role]) -> Dict[Argument, Question]:
+    # The question with the smallest text among those each argument answers,
+    # so the order of the roles does not matter
+    arg_to_question = {}
+    for role in roles:
+        for arg in role.arguments:
+            question = arg_to_question.get(arg)
+            if question is None or role.question < question:
+                arg_to_question[arg] = role.question
+    return arg_to_question
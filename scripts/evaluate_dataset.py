@@ -1,103 +1,388 @@
+import cProfile
+import csv
 import os
+from collections import defaultdict
 
-from typing import List, Dict, Generator, Tuple
+from typing import Any, Callable, List, Dict, Tuple, Iterable, Iterator, Optional, TextIO
+from multiprocessing import Pool
 import pandas as pd
 import numpy as np
 from argparse import ArgumentParser
 
 from tqdm import tqdm
 
-from evaluate import evaluate, Metrics, match_arguments
+from evaluate import evaluate, Metrics, match_arguments, MATCHING_BACKENDS, MATCHING_BACKEND
 from common import Question, Role, QUESTION_FIELDS, Argument
-from decode_encode_answers import NO_RANGE, decode_qasrl
+from decode_encode_answers import NO_RANGE
+from dataset_cache import SPAN_ARRAYS, load_qasrl
+from paraphrases import PARAPHRASE_CLASSES, init_paraphrase_classes
+from profiling import PROFILER
+from result_cache import ResultCache, predicate_hash, alignment_hash, COUNTS, ALIGNMENT, DEFAULT_MAX_BYTES
+from sentence_store import SentenceStore, load_sentences
 
 
 def to_arg_roles(roles: List[Role]):
     return [(arg, role.question) for role in roles for arg in role.arguments]
 
 
-def build_all_arg_roles(sys_roles: List[Role],
-                        grt_roles: List[Role],
-                        sys_to_grt_matches: Dict[Argument, Argument]):
-    grt_arg_roles = to_arg_roles(grt_roles)
-    sys_arg_roles = to_arg_roles(sys_roles)
-    
-    grt_arg_roles = pd.DataFrame(grt_arg_roles, columns=["grt_arg", "grt_role"])
-    sys_arg_roles = pd.DataFrame(sys_arg_roles, columns=["sys_arg", "sys_role"])
-    # Dictionary mapping with None values
-    sys_arg_roles['grt_arg'] = sys_arg_roles.sys_arg.apply(sys_to_grt_matches.get)
-    all_arg_roles = pd.merge(sys_arg_roles, grt_arg_roles, on="grt_arg", how="outer")
-    all_arg_roles.grt_arg.fillna(NO_RANGE, inplace=True)
-    all_arg_roles.sys_arg.fillna(NO_RANGE, inplace=True)
-
+def merge_arg_roles(sys_arg_roles: List[Tuple[Argument, Question]],
+                    grt_arg_roles: List[Tuple[Argument, Question]],
+                    sys_to_grt_matches: Dict[Argument, Argument]) -> List[Tuple[Argument, Question, Argument, Question]]:
+    # Full outer join of system and gold arguments on the matched gold argument,
+    # as (grt_arg, grt_role, sys_arg, sys_role) with None for a missing role.
+    # Rows come in the order of an outer pd.merge: system rows grouped by their gold argument
+    # (None for unmatched ones) in order of first appearance, then the gold only arguments.
+    grt_by_arg = defaultdict(list)
+    for grt_arg, grt_role in grt_arg_roles:
+        grt_by_arg[grt_arg].append(grt_role)
+    sys_by_grt_arg = defaultdict(list)
+    for sys_arg, sys_role in sys_arg_roles:
+        sys_by_grt_arg[sys_to_grt_matches.get(sys_arg)].append((sys_arg, sys_role))
+
+    all_arg_roles = []
+    for grt_arg, sys_items in sys_by_grt_arg.items():
+        grt_items = grt_by_arg.get(grt_arg, [None])
+        for sys_arg, sys_role in sys_items:
+            all_arg_roles.extend((NO_RANGE if grt_arg is None else grt_arg, grt_role, sys_arg, sys_role)
+                                 for grt_role in grt_items)
+    for grt_arg, grt_items in grt_by_arg.items():
+        if grt_arg not in sys_by_grt_arg:
+            all_arg_roles.extend((grt_arg, grt_role, NO_RANGE, None) for grt_role in grt_items)
     return all_arg_roles
 
 
-def filter_ids(df, row):
-    return (df.qasrl_id == row.qasrl_id) & (df.verb_idx == row.verb_idx)
-
-
-def fill_answer(arg: Argument, tokens: List[str]):
-    if arg == NO_RANGE:
-        return NO_RANGE
-    return " ".join(tokens[arg[0]: arg[1]])
-
-
-def eval_datasets(grt_df, sys_df) -> Tuple[Metrics, Metrics, Metrics]:
-    unlabelled_arg_counts = np.zeros(3, dtype=np.float32)
-    labelled_arg_counts = np.zeros(3, dtype=np.float32)
-    unlabelled_role_counts = np.zeros(3, dtype=np.float32)
-    for key, sys_roles, grt_roles in yield_paired_predicates(sys_df, grt_df):
-        local_arg, local_qna, local_role = evaluate(sys_roles, grt_roles)
-
-        unlabelled_arg_counts += np.array(local_arg.as_tuple())
-        labelled_arg_counts += np.array(local_qna.as_tuple())
-        unlabelled_role_counts += np.array(local_role.as_tuple())
-
-    unlabelled_arg_counts = Metrics(*unlabelled_arg_counts)
-    labelled_arg_counts = Metrics(*labelled_arg_counts)
-    unlabelled_role_counts = Metrics(*unlabelled_role_counts)
+class SentenceText:
+    # The space joined sentence and the character offset of every token in it,
+    # so the text of any span is a single slice instead of a join over its tokens.
+    def __init__(self, tokens: List[str]):
+        self.text = " ".join(tokens)
+        self.n_tokens = len(tokens)
+        self.offsets = [0] * (self.n_tokens + 1)
+        for token_idx, token in enumerate(tokens):
+            self.offsets[token_idx + 1] = self.offsets[token_idx] + len(token) + 1
+
+    def span_texts(self, args: Iterable[Argument]) -> List[str]:
+        texts = []
+        for arg in args:
+            if arg == NO_RANGE:
+                texts.append(NO_RANGE)
+                continue
+            # Same bounds as slicing the token list
+            start, end, _ = slice(arg[0], arg[1]).indices(self.n_tokens)
+            texts.append(self.text[self.offsets[start]: self.offsets[end] - 1] if start < end else "")
+        return texts
+
+
+def sentence_text(sent_map, qasrl_id):
+    # Sentences of a SentenceStore render their spans from the store, without building the token list
+    if isinstance(sent_map, SentenceStore):
+        return sent_map.sentence(qasrl_id)
+    return SentenceText(sent_map[qasrl_id])
+
+
+EVAL_CHUNK_SIZE = 64
+# TP, FP and FN of the unlabelled argument, labelled argument and unlabelled role metrics
+COUNT_COLUMNS = ['arg_tp', 'arg_fp', 'arg_fn',
+                 'label_arg_tp', 'label_arg_fp', 'label_arg_fn',
+                 'role_tp', 'role_fp', 'role_fn']
+# Set by init_pool_state, in each process of a pool started by map_in_pool (or in this process when running
+# serially). Holds what the tasks of the pool share: indexed datasets, settings and the like.
+POOL_STATE = {}
+
+
+def eval_datasets(grt_df, sys_df, include_sys_only=False,
+                  matching_backend: str = None,
+                  workers: int = 1,
+                  chunk_size: int = EVAL_CHUNK_SIZE,
+                  result_cache: ResultCache = None) -> Tuple[Metrics, Metrics, Metrics]:
+    # Integer sums are exact, so the result of a parallel run equals a serial one
+    counts = sum_counts(counts for key, counts
+                        in yield_predicate_counts(grt_df, sys_df, include_sys_only,
+                                                  matching_backend, workers, chunk_size, result_cache))
+    return metrics_from_counts(counts)
+
+
+def eval_predicate_table(grt_df, sys_df, include_sys_only=False,
+                         matching_backend: str = None,
+                         workers: int = 1,
+                         chunk_size: int = EVAL_CHUNK_SIZE,
+                         result_cache: ResultCache = None) -> pd.DataFrame:
+    # One row of int32 counts per predicate, in the order predicates are paired
+    keys, all_counts = [], []
+    for key, counts in yield_predicate_counts(grt_df, sys_df, include_sys_only,
+                                              matching_backend, workers, chunk_size, result_cache):
+        keys.append(key)
+        all_counts.append(counts)
+    table = pd.DataFrame(keys, columns=['qasrl_id', 'verb_idx'])
+    counts = pd.DataFrame(np.array(all_counts, dtype=np.int32).reshape(-1, len(COUNT_COLUMNS)),
+                          columns=COUNT_COLUMNS)
+    return pd.concat([table, counts], axis=1)
+
+
+def metrics_from_counts(counts) -> Tuple[Metrics, Metrics, Metrics]:
+    counts = [int(count) for count in counts]
+    unlabelled_arg_counts = Metrics(*counts[0:3])
+    labelled_arg_counts = Metrics(*counts[3:6])
+    unlabelled_role_counts = Metrics(*counts[6:9])
 
     return unlabelled_arg_counts, labelled_arg_counts, unlabelled_role_counts
 
 
-def build_alignment(sys_df, grt_df, sent_map):
-    all_matches = []
-    paired_predicates = tqdm(yield_paired_predicates(sys_df, grt_df), leave=False)
-    for (qasrl_id, verb_idx), sys_roles, grt_roles in paired_predicates:
-        tokens = sent_map[qasrl_id]
-        grt_args = set(arg for role in grt_roles for arg in role.arguments)
-        sys_args = set(arg for role in sys_roles for arg in role.arguments)
-        sys_to_grt_arg, unmatched_sys_args, unmatched_grt_args = match_arguments(grt_args, sys_args)
-
-        sys_roles_consolidated = [Role(role.question,
-                                       set(arg for arg in role.arguments
-                                        if arg in sys_to_grt_arg or arg in unmatched_sys_args)
-                                       ) for role in sys_roles]
-        # TODO:
-        # Our consolidation of redundancies is based only on arguments and may remove questions
-        # This is more common for the parser that predicts spans and their questions independently
-        sys_roles_consolidated = [role for role in sys_roles_consolidated if role.arguments]
-
-        all_args = build_all_arg_roles(sys_roles_consolidated, grt_roles, sys_to_grt_arg)
-        all_args['qasrl_id'] = qasrl_id
-        all_args['verb_idx'] = verb_idx
-        all_args['grt_arg_text'] = all_args.grt_arg.apply(fill_answer, tokens=tokens)
-        all_args['sys_arg_text'] = all_args.sys_arg.apply(fill_answer, tokens=tokens)
-        all_matches.append(all_args)
-
-    all_matches = pd.concat(all_matches)
-    all_matches = all_matches[['grt_arg_text', 'sys_arg_text',
-                                   'grt_role', 'sys_role',
-                                   'grt_arg', 'sys_arg',
-                                   'qasrl_id', 'verb_idx']].copy()
-    return all_matches
-
-
-def main(proposed_path: str, reference_path: str, sents_path=None):
-    sys_df = decode_qasrl(pd.read_csv(proposed_path))
-    grt_df = decode_qasrl(pd.read_csv(reference_path))
-    unlabelled_arg, labelled_arg, unlabelled_role = eval_datasets(grt_df, sys_df)
+def yield_predicate_counts(grt_df, sys_df, include_sys_only=False,
+                           matching_backend: str = None,
+                           workers: int = 1,
+                           chunk_size: int = EVAL_CHUNK_SIZE,
+                           result_cache: ResultCache = None) -> Iterator[Tuple[Tuple[str, int], Tuple[int, ...]]]:
+    sys_index = as_predicate_index(sys_df)
+    grt_index = as_predicate_index(grt_df)
+    keys = list(yield_paired_keys(sys_index, grt_index, include_sys_only))
+    if result_cache is None:
+        yield from compute_predicate_counts(keys, sys_index, grt_index, matching_backend, workers, chunk_size)
+        return
+
+    # Only predicates whose roles changed since they were last scored are evaluated again
+    content_hashes = [predicate_hash(sys_index.roles(key), grt_index.roles(key), matching_backend)
+                      for key in keys]
+    cached = result_cache.get_many(COUNTS, content_hashes)
+    miss_keys = [key for key, content_hash in zip(keys, content_hashes) if content_hash not in cached]
+    computed = dict(compute_predicate_counts(miss_keys, sys_index, grt_index, matching_backend, workers, chunk_size))
+    result_cache.put_many(COUNTS, ((content_hash, computed[key])
+                                   for key, content_hash in zip(keys, content_hashes) if key in computed))
+    for key, content_hash in zip(keys, content_hashes):
+        yield key, computed[key] if key in computed else cached[content_hash]
+
+
+def compute_predicate_counts(keys: List[Tuple[str, int]], sys_index: 'PredicateIndex', grt_index: 'PredicateIndex',
+                             matching_backend: str = None, workers: int = 1,
+                             chunk_size: int = EVAL_CHUNK_SIZE) -> Iterator[Tuple[Tuple[str, int], Tuple[int, ...]]]:
+    if workers > 1:
+        key_chunks = list(chunked(keys, chunk_size))
+        pool_state = {'sys_index': sys_index, 'grt_index': grt_index, 'matching_backend': matching_backend}
+        # Chunks come out in order, predicates in the same order as a serial run
+        for chunk_keys, (chunk_counts, profile) in zip(key_chunks, map_in_pool(eval_predicate_chunk, key_chunks,
+                                                                               pool_state, workers)):
+            PROFILER.merge(profile)
+            yield from zip(chunk_keys, chunk_counts)
+    else:
+        for key in keys:
+            yield key, evaluate_counts(sys_index.roles(key), grt_index.roles(key), matching_backend)
+
+
+def evaluate_counts(sys_roles: List[Role], grt_roles: List[Role], matching_backend: str = None) -> Tuple[int, ...]:
+    # Counts in the order of COUNT_COLUMNS
+    local_arg, local_qna, local_role = evaluate(sys_roles, grt_roles, matching_backend)
+    return local_arg.as_tuple() + local_qna.as_tuple() + local_role.as_tuple()
+
+
+def sum_counts(all_counts: Iterable[Tuple[int, ...]]) -> List[int]:
+    total = [0] * 9
+    for counts in all_counts:
+        total = [total_count + count for total_count, count in zip(total, counts)]
+    return total
+
+
+def chunked(items: list, chunk_size: int) -> Iterator[list]:
+    for start in range(0, len(items), chunk_size):
+        yield items[start: start + chunk_size]
+
+
+def init_pool_state(pool_state: dict):
+    POOL_STATE.update(pool_state)
+
+
+def init_pool_process(pool_state: dict, class_ids: Dict[tuple, int], profile: bool):
+    init_pool_state(pool_state)
+    init_paraphrase_classes(class_ids)
+    # Forked processes start with a copy of what the parent profiler already collected
+    PROFILER.reset()
+    PROFILER.enabled = profile
+
+
+def map_in_pool(fn: Callable[[Any], Any], items: list, pool_state: dict, workers: int = 1) -> Iterator[Any]:
+    # fn of every item, in the order of the items. With workers > 1 the items are spread over a pool
+    # whose processes get pool_state in POOL_STATE, along with the paraphrase classes and profiler settings
+    # of this process, since spawned processes do not inherit them.
+    if workers > 1 and len(items) > 1:
+        with Pool(min(workers, len(items)), initializer=init_pool_process,
+                  initargs=(pool_state, dict(PARAPHRASE_CLASSES.class_ids), PROFILER.enabled)) as pool:
+            yield from pool.imap(fn, items)
+    else:
+        init_pool_state(pool_state)
+        yield from map(fn, items)
+
+
+def sum_chunk_counts(chunk_fn: Callable[[list], np.ndarray], keys: List[Tuple[str, int]], pool_state: dict,
+                     n_rows: int, workers: int = 1, chunk_size: int = EVAL_CHUNK_SIZE) -> np.ndarray:
+    # Sum of the (n_rows, 9) counts that chunk_fn returns for each chunk of predicates, n_rows being e.g.
+    # the number of thresholds of a sweep
+    total = np.zeros((n_rows, len(COUNT_COLUMNS)), dtype=np.int64)
+    for chunk_counts in map_in_pool(chunk_fn, list(chunked(keys, chunk_size)), pool_state, workers):
+        total += chunk_counts
+    return total
+
+
+def eval_predicate_chunk(keys: List[Tuple[str, int]]) -> Tuple[List[Tuple[int, ...]], Optional[dict]]:
+    # Also returns what the profiler collected for the chunk (None when profiling is off)
+    sys_index, grt_index = POOL_STATE['sys_index'], POOL_STATE['grt_index']
+    matching_backend = POOL_STATE['matching_backend']
+    chunk_counts = [evaluate_counts(sys_index.roles(key), grt_index.roles(key), matching_backend)
+                    for key in keys]
+    return chunk_counts, PROFILER.pop_snapshot()
+
+
+ALIGNMENT_COLUMNS = ['grt_arg_text', 'sys_arg_text',
+                     'grt_role', 'sys_role',
+                     'grt_arg', 'sys_arg',
+                     'qasrl_id', 'verb_idx']
+
+
+ALIGNMENT_BATCH_ROWS = 10000
+
+
+def write_alignment(align_path: str, sys_df, grt_df, sent_map, include_sys_only=False,
+                    matching_backend: str = None, result_cache: ResultCache = None,
+                    batch_rows: int = ALIGNMENT_BATCH_ROWS):
+    with open(align_path, "w", encoding="utf-8", newline="") as fout:
+        write_alignment_csv(fout, sys_df, grt_df, sent_map, include_sys_only, matching_backend, result_cache,
+                            batch_rows)
+
+
+def write_alignment_csv(fout: TextIO, sys_df, grt_df, sent_map, include_sys_only=False,
+                        matching_backend: str = None, result_cache: ResultCache = None,
+                        batch_rows: int = ALIGNMENT_BATCH_ROWS, progress: bool = True):
+    # Streams the rows to the CSV in the same format DataFrame.to_csv writes them
+    writer = csv.writer(fout, lineterminator="\n")
+    writer.writerow(ALIGNMENT_COLUMNS)
+    batch = []
+    for predicate_rows in yield_sorted_alignment(sys_df, grt_df, sent_map, include_sys_only,
+                                                 matching_backend, result_cache, progress):
+        batch.extend(predicate_rows)
+        if len(batch) >= batch_rows:
+            writer.writerows(batch)
+            batch = []
+    writer.writerows(batch)
+
+
+def yield_sorted_alignment(sys_df, grt_df, sent_map, include_sys_only=False, matching_backend: str = None,
+                           result_cache: ResultCache = None, progress: bool = True) -> Iterator[List[tuple]]:
+    # Rows of each predicate, ordered by qasrl_id, verb_idx and gold question as in the alignment file.
+    # Sorting predicates first and then the rows of each one gives the order of a stable sort over all rows.
+    sys_index = as_predicate_index(sys_df)
+    grt_index = as_predicate_index(grt_df)
+    keys = sorted(yield_paired_keys(sys_index, grt_index, include_sys_only))
+    if result_cache is not None:
+        # Alignment rows carry the predicate key, so it is part of the cache key along with the tokens
+        content_hashes = [alignment_hash(predicate_hash(sys_index.roles(key), grt_index.roles(key), matching_backend),
+                                         [str(key)] + sent_map[key[0]])
+                          for key in keys]
+        cached = result_cache.get_many(ALIGNMENT, content_hashes)
+    else:
+        content_hashes, cached = [None] * len(keys), {}
+
+    computed = {}
+    sentence = None
+    for key, content_hash in tqdm(zip(keys, content_hashes), total=len(keys), leave=False, disable=not progress):
+        if content_hash in cached:
+            yield cached[content_hash]
+            continue
+        # Sorted keys keep the predicates of a sentence together
+        if sentence is None or sentence[0] != key[0]:
+            sentence = (key[0], sentence_text(sent_map, key[0]))
+        rows = sort_alignment_rows(alignment_rows(key, sys_index.roles(key), grt_index.roles(key),
+                                                  sentence[1], matching_backend))
+        if PROFILER.enabled:
+            PROFILER.count('alignment_rows', len(rows))
+        if content_hash is not None:
+            computed[content_hash] = rows
+        yield rows
+    if result_cache is not None:
+        result_cache.put_many(ALIGNMENT, computed.items())
+
+
+def sort_alignment_rows(rows: List[tuple]) -> List[tuple]:
+    # Stable sort on the gold question, with rows of unmatched system arguments last
+    grt_role_idx = ALIGNMENT_COLUMNS.index('grt_role')
+    return sorted(rows, key=lambda row: (row[grt_role_idx] is None, row[grt_role_idx] or ""))
+
+
+def align_predicate(key: Tuple[str, int], sys_roles: List[Role], grt_roles: List[Role],
+                    tokens: List[str], matching_backend: str = None) -> pd.DataFrame:
+    rows = alignment_rows(key, sys_roles, grt_roles, SentenceText(tokens), matching_backend)
+    return pd.DataFrame(rows, columns=ALIGNMENT_COLUMNS)
+
+
+def alignment_rows(key: Tuple[str, int], sys_roles: List[Role], grt_roles: List[Role],
+                   sentence: SentenceText, matching_backend: str = None) -> List[tuple]:
+    # One tuple per aligned argument pair, in the order of ALIGNMENT_COLUMNS
+    qasrl_id, verb_idx = key
+    grt_args = set(arg for role in grt_roles for arg in role.arguments)
+    sys_args = set(arg for role in sys_roles for arg in role.arguments)
+    sys_to_grt_arg, unmatched_sys_args, unmatched_grt_args = match_arguments(grt_args, sys_args, matching_backend)
+
+    # TODO:
+    # Our consolidation of redundancies is based only on arguments and may remove questions
+    # This is more common for the parser that predicts spans and their questions independently
+    # The kept arguments of a system role are iterated as a set, like the Role consolidation this replaced,
+    # so rows keep the order of earlier alignment files.
+    sys_arg_roles = [(arg, role.question) for role in sys_roles
+                     for arg in set(arg for arg in role.arguments
+                                    if arg in sys_to_grt_arg or arg in unmatched_sys_args)]
+
+    all_args = merge_arg_roles(sys_arg_roles, to_arg_roles(grt_roles), sys_to_grt_arg)
+    grt_texts = sentence.span_texts(grt_arg for grt_arg, _, _, _ in all_args)
+    sys_texts = sentence.span_texts(sys_arg for _, _, sys_arg, _ in all_args)
+    return [(grt_text, sys_text,
+             None if grt_role is None else str(grt_role), None if sys_role is None else str(sys_role),
+             grt_arg, sys_arg, qasrl_id, verb_idx)
+            for (grt_arg, grt_role, sys_arg, sys_role), grt_text, sys_text in zip(all_args, grt_texts, sys_texts)]
+
+
+def main(proposed_path: str, reference_path: str, sents_path=None, include_sys_only=False,
+         matching_backend: str = None, workers: int = 1, use_cache: bool = False,
+         predicate_counts_path: str = None, result_cache_path: str = None,
+         result_cache_bytes: int = DEFAULT_MAX_BYTES, profile_path: str = None, cprofile_path: str = None):
+    PROFILER.enabled = profile_path is not None
+    cprofiler = cProfile.Profile() if cprofile_path is not None else None
+    if cprofiler is not None:
+        cprofiler.enable()
+    try:
+        run_evaluation(proposed_path, reference_path, sents_path, include_sys_only, matching_backend, workers,
+                       use_cache, predicate_counts_path, result_cache_path, result_cache_bytes)
+    finally:
+        if cprofiler is not None:
+            # Only covers the main process, pool processes are not profiled
+            cprofiler.disable()
+            cprofiler.dump_stats(cprofile_path)
+    if profile_path is not None:
+        print(PROFILER.report())
+        PROFILER.write_json(profile_path)
+        print(profile_path)
+
+
+def run_evaluation(proposed_path: str, reference_path: str, sents_path=None, include_sys_only=False,
+                   matching_backend: str = None, workers: int = 1, use_cache: bool = False,
+                   predicate_counts_path: str = None, result_cache_path: str = None,
+                   result_cache_bytes: int = DEFAULT_MAX_BYTES):
+    result_cache = ResultCache(result_cache_path, result_cache_bytes) if result_cache_path else None
+    sys_df = load_qasrl(proposed_path, use_cache)
+    grt_df = load_qasrl(reference_path, use_cache)
+    with PROFILER.stage('indexing'):
+        sys_index = PredicateIndex(sys_df)
+        grt_index = PredicateIndex(grt_df)
+    n_sys_only = sum(1 for key in sys_index.keys() if key not in grt_index)
+    if n_sys_only:
+        action = "counted as false positives" if include_sys_only else "ignored"
+        print(f"Predicates found only in system output: {n_sys_only} ({action})")
+    with PROFILER.stage('scoring'):
+        if predicate_counts_path is not None:
+            table = eval_predicate_table(grt_index, sys_index, include_sys_only, matching_backend, workers,
+                                         result_cache=result_cache)
+            table.to_csv(predicate_counts_path, index=False, encoding="utf-8")
+            unlabelled_arg, labelled_arg, unlabelled_role = metrics_from_counts(table[COUNT_COLUMNS].sum(axis=0))
+        else:
+            unlabelled_arg, labelled_arg, unlabelled_role = eval_datasets(grt_index, sys_index, include_sys_only,
+                                                                           matching_backend, workers,
+                                                                           result_cache=result_cache)
     print("Metrics:\tPrecision\tRecall\tF1")
     print(f"Unlabelled Argument: {unlabelled_arg}")
     print(f"labelled Argument: {labelled_arg}")
@@ -109,46 +394,120 @@ def main(proposed_path: str, reference_path: str, sents_path=None):
     print(f"Unlabelled Role: {' '.join(str(t) for t in unlabelled_role.as_tuple())}")
 
     if sents_path is not None:
-        sents = pd.read_csv(sents_path)
-        sent_map = dict(zip(sents.qasrl_id, sents.tokens.apply(str.split)))
-        align = build_alignment(sys_df, grt_df, sent_map)
-        b1_dir, b1_name = os.path.split(proposed_path)
-        b1 = os.path.splitext(b1_name)[0]
-        b2 = os.path.splitext(os.path.basename(reference_path))[0]
-        align_path = os.path.join(b1_dir, f"{b1}_{b2}.align.csv")
+        sent_map = load_sentences(sents_path, use_cache)
+        align_path = get_alignment_path(proposed_path, reference_path)
         print(align_path)
-        align.sort_values(['qasrl_id','verb_idx', 'grt_role'], inplace=True)
-        align.to_csv(align_path, encoding="utf-8", index=False)
-
-
-def yield_paired_predicates(sys_df: pd.DataFrame, grt_df: pd.DataFrame):
-    predicate_ids = grt_df[['qasrl_id', 'verb_idx']].drop_duplicates()
-    for idx, row in predicate_ids.iterrows():
-        sys_arg_roles = sys_df[filter_ids(sys_df, row)].copy()
-        grt_arg_roles = grt_df[filter_ids(grt_df, row)].copy()
-        sys_roles = list(yield_roles(sys_arg_roles))
-        grt_roles = list(yield_roles(grt_arg_roles))
-        yield (row.qasrl_id, row.verb_idx), sys_roles, grt_roles
-
-
-def question_from_row(row: pd.Series) -> Question:
-        question_as_dict = {question_field: row[question_field]
-                            for question_field in QUESTION_FIELDS}
-        question_as_dict['text'] = row.question
-        return Question(**question_as_dict)
-
-
-def yield_roles(predicate_df: pd.DataFrame) -> Generator[Role, None, None]:
-    for row_idx, role_row in predicate_df.iterrows():
-        question = question_from_row(role_row)
-        arguments: List[Argument] = role_row.answer_range
-        yield Role(question, tuple(arguments))
+        with PROFILER.stage('alignment'):
+            write_alignment(align_path, sys_index, grt_index, sent_map, include_sys_only, matching_backend,
+                            result_cache)
+
+    if result_cache is not None:
+        print(result_cache.report())
+        result_cache.close()
+
+
+def get_alignment_path(proposed_path: str, reference_path: str) -> str:
+    b1_dir, b1_name = os.path.split(proposed_path)
+    b1 = os.path.splitext(b1_name)[0]
+    b2 = os.path.splitext(os.path.basename(reference_path))[0]
+    return os.path.join(b1_dir, f"{b1}_{b2}.align.csv")
+
+
+def yield_paired_predicates(sys_df, grt_df, include_sys_only: bool = False):
+    sys_index = as_predicate_index(sys_df)
+    grt_index = as_predicate_index(grt_df)
+    for key in yield_paired_keys(sys_index, grt_index, include_sys_only):
+        yield key, sys_index.roles(key), grt_index.roles(key)
+
+
+def yield_paired_keys(sys_index: 'PredicateIndex', grt_index: 'PredicateIndex', include_sys_only: bool = False):
+    # Gold predicates are yielded in order of appearance.
+    # Predicates that appear only in the system output are dropped unless include_sys_only is set,
+    # in which case they are yielded last and get an empty list of gold roles.
+    yield from grt_index.keys()
+    if include_sys_only:
+        for key in sys_index.keys():
+            if key not in grt_index:
+                yield key
+
+
+class PredicateIndex:
+    def __init__(self, qasrl_df: pd.DataFrame):
+        cols = ['qasrl_id', 'verb_idx']
+        self.groups = qasrl_df.groupby(cols, sort=False, observed=True).indices if len(qasrl_df) else {}
+        # Object arrays of interned columns share the strings of their categories
+        self.questions = np.asarray(qasrl_df.question)
+        self.question_fields = {field: np.asarray(qasrl_df[field]) for field in QUESTION_FIELDS}
+        self.answer_ranges = qasrl_df.answer_range.values
+        # Frames read from the dataset cache hold cache rows, whose spans are kept in flat arrays
+        self.span_arrays = qasrl_df.attrs.get(SPAN_ARRAYS, {}).get('answer_range')
+        self.paraphrase_ids = PARAPHRASE_CLASSES.class_ids_of_frame(qasrl_df).tolist()
+
+    def keys(self):
+        return self.groups.keys()
+
+    def __contains__(self, key):
+        return key in self.groups
+
+    def __len__(self):
+        return len(self.groups)
+
+    def roles(self, key) -> List[Role]:
+        row_indices = self.groups.get(key)
+        if row_indices is None:
+            return []
+        return [self.role_at(row_idx) for row_idx in row_indices]
+
+    def role_at(self, row_idx: int) -> Role:
+        question_as_dict = {question_field: values[row_idx]
+                            for question_field, values in self.question_fields.items()}
+        question_as_dict['text'] = self.questions[row_idx]
+        question_as_dict['paraphrase_id'] = self.paraphrase_ids[row_idx]
+        if self.span_arrays is None:
+            arguments = tuple(self.answer_ranges[row_idx])
+        else:
+            arguments = self.span_arrays.argument(self.answer_ranges[row_idx])
+        return Role(Question(**question_as_dict), arguments)
+
+
+def index_by_worker(annot_df: pd.DataFrame) -> Dict[str, PredicateIndex]:
+    return {worker_id: PredicateIndex(worker_df)
+            for worker_id, worker_df in annot_df.groupby('worker_id', sort=True, observed=True)}
+
+
+def as_predicate_index(qasrl_data) -> PredicateIndex:
+    if isinstance(qasrl_data, PredicateIndex):
+        return qasrl_data
+    return PredicateIndex(qasrl_data)
 
 
 if __name__ == "__main__":
     ap = ArgumentParser()
     ap.add_argument("sys_path")
     ap.add_argument("ground_truth_path")
-    ap.add_argument("-s","--sentences_path", required=False)
+    ap.add_argument("-s","--sentences_path", required=False,
+                    help="Sentences CSV, or a store built by sentence_store.py, to write the alignment file")
+    ap.add_argument("--include_sys_only", action="store_true",
+                    help="Score predicates that appear only in the system output instead of ignoring them")
+    ap.add_argument("--matcher", choices=MATCHING_BACKENDS, default=MATCHING_BACKEND,
+                    help="Algorithm used to align system and gold arguments one to one")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="Number of processes used to score predicates")
+    ap.add_argument("--cache", action="store_true",
+                    help="Load decoded datasets from a binary cache next to each CSV, building it if needed, "
+                         "and the sentences from a memory mapped store")
+    ap.add_argument("--predicate_counts", required=False,
+                    help="Write the TP/FP/FN counts of every predicate to this CSV (input for significance.py)")
+    ap.add_argument("--result_cache", required=False,
+                    help="SQLite file of per-predicate results, only predicates that changed since a previous run "
+                         "are scored again")
+    ap.add_argument("--result_cache_mb", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                    help="Least recently used results are evicted once the result cache grows past this size")
+    ap.add_argument("--profile", required=False,
+                    help="Write wall and CPU time per stage and pipeline counters to this JSON file")
+    ap.add_argument("--cprofile", required=False,
+                    help="Write a cProfile dump of the main process to this file (read it with pstats)")
     args = ap.parse_args()
-    main(args.sys_path, args.ground_truth_path, args.sentences_path)
+    main(args.sys_path, args.ground_truth_path, args.sentences_path, args.include_sys_only, args.matcher,
+         args.workers, args.cache, args.predicate_counts, args.result_cache, args.result_cache_mb * 1024 * 1024,
+         args.profile, args.cprofile)
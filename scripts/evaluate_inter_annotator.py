@@ -1,5 +1,5 @@
 from argparse import ArgumentParser
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
 import pandas as pd
 import numpy as np
@@ -8,54 +8,120 @@ from glob import glob
 from itertools import combinations, product
 
 from common import Role, Argument
-from evaluate import Metrics, joint_len, iou
-from evaluate_dataset import eval_datasets, yield_paired_predicates
-from decode_encode_answers import decode_qasrl
+from evaluate import Metrics, joint_len, iou, span_iou_matrix, align_matrix_one_to_one
+from evaluate_dataset import eval_datasets, yield_paired_predicates, evaluate_counts, sum_counts, \
+    index_by_worker, map_in_pool, COUNT_COLUMNS, POOL_STATE
+from dataset_cache import load_qasrl
+
+
+AGREEMENT_IOU_THRESHOLD = 0.3
+# Pairwise scores shown as worker x worker matrices
+AGREEMENT_MATRIX_VALUES = ['f1', 'label_f1']
+WH_CLASS_IDS = {'who': 0, 'what': 0}
 
 
 def is_argument_match(arguments1: List[Argument], arguments2: List[Argument]):
     for arg1, arg2 in product(arguments1, arguments2):
-        if iou(arg1, arg2) >= 0.3:
+        if iou(arg1, arg2) >= AGREEMENT_IOU_THRESHOLD:
             return True
     return False
 
 
-def evaluate_agreement(roles1: List[Role], roles2: List[Role]) -> int:
-    used_roles1 = set()
-    used_roles2 = set()
-    n_matches = 0
-    for role1, role2 in product(roles1, roles2):
-        # if role1 in used_roles1 or role2 in used_roles2:
-            # continue
-
-        q1 = role1.question.wh.lower()
-        q2 = role2.question.wh.lower()
-        q1 = 'whowhat' if q1 in ('who', 'what') else q1
-        q2 = 'whowhat' if q2 in ('who', 'what') else q2
-        is_wh_match = q1 == q2
-        if is_argument_match(role1.arguments, role2.arguments):
-            if not is_wh_match:
-                print(role1.question.text, role2.question.text)
-        if is_wh_match and is_argument_match(role1.arguments, role2.arguments):
-            n_matches += 1
-            used_roles1.add(role1)
-            used_roles2.add(role2)
-    return n_matches
-
-
-def eval_datasets_for_agreement(df1, df2):
+def evaluate_agreement(roles1: List[Role], roles2: List[Role], one_to_one: bool = False) -> int:
+    # Counts pairs of roles that share a wh-class and have overlapping arguments.
+    # With one_to_one, each role may take part in a single match.
+    is_match = role_match_matrix(roles1, roles2)
+    if one_to_one:
+        roles1_indices, _ = align_matrix_one_to_one(is_match.astype(np.float64), is_match)
+        return len(roles1_indices)
+    return int(is_match.sum())
+
+
+def role_match_matrix(roles1: List[Role], roles2: List[Role],
+                      threshold: float = AGREEMENT_IOU_THRESHOLD) -> np.ndarray:
+    is_wh_match = wh_class_ids(roles1)[:, None] == wh_class_ids(roles2)[None, :]
+    span_roles1, spans1 = flatten_role_arguments(roles1)
+    span_roles2, spans2 = flatten_role_arguments(roles2)
+    is_span_match = span_iou_matrix(spans1, spans2) >= threshold
+    # roles1 x spans1 and roles2 x spans2 membership matrices lift the span matches to the roles
+    membership1 = np.zeros((len(roles1), len(spans1)), dtype=np.int64)
+    membership1[span_roles1, np.arange(len(spans1))] = 1
+    membership2 = np.zeros((len(roles2), len(spans2)), dtype=np.int64)
+    membership2[span_roles2, np.arange(len(spans2))] = 1
+    is_argument_overlap = (membership1 @ is_span_match @ membership2.T) > 0
+    return is_wh_match & is_argument_overlap
+
+
+def flatten_role_arguments(roles: List[Role]) -> Tuple[np.ndarray, List[Argument]]:
+    span_roles = np.repeat(np.arange(len(roles)), [len(role.arguments) for role in roles])
+    spans = [arg for role in roles for arg in role.arguments]
+    return span_roles, spans
+
+
+def wh_class_ids(roles: List[Role]) -> np.ndarray:
+    return np.array([wh_class_id(role.question.wh) for role in roles], dtype=np.int64)
+
+
+def wh_class_id(wh: str) -> int:
+    # who and what share a class, every other wh-word gets a class of its own
+    wh = wh.lower()
+    if wh not in WH_CLASS_IDS:
+        WH_CLASS_IDS[wh] = max(WH_CLASS_IDS.values()) + 1
+    return WH_CLASS_IDS[wh]
+
+
+def eval_datasets_for_agreement(df1, df2, one_to_one: bool = False):
     n_matches = 0
     n_total_roles = 0
     for key, roles1, roles2 in yield_paired_predicates(df1, df2):
-        local_n_matches = evaluate_agreement(roles1, roles2)
+        local_n_matches = evaluate_agreement(roles1, roles2, one_to_one)
         n_matches += local_n_matches
         n_total_roles += len(roles1) + len(roles2) - local_n_matches
     return n_matches, n_total_roles
 
 
-def evaluate_generator_agreement(annot_df: pd.DataFrame, sent_map: Dict[str, List[str]]):
+def evaluate_worker_pair(worker_pair: Tuple[str, str]) -> Tuple[int, List[int]]:
+    # The first worker plays the reference, only predicates annotated by both workers are compared
+    w1, w2 = worker_pair
+    index1 = POOL_STATE['worker_indices'][w1]
+    index2 = POOL_STATE['worker_indices'][w2]
+    shared_keys = [key for key in index1.keys() if key in index2]
+    counts = sum_counts(evaluate_counts(index2.roles(key), index1.roles(key)) for key in shared_keys)
+    return len(shared_keys), counts
+
+
+def f1_score(tp, fp, fn) -> float:
+    return 2 * tp / (2 * tp + fp + fn) if tp else 0.0
+
+
+def evaluate_pairwise_agreement(annot_df: pd.DataFrame, workers: int = 1) -> pd.DataFrame:
+    # Annotations are indexed once by worker and predicate, every pair of workers is then scored
+    # on the predicates they share. Returns one row of counts and F1 scores per pair of workers.
+    worker_indices = index_by_worker(annot_df)
+    worker_pairs = list(combinations(annot_df.worker_id.dropna().unique().tolist(), r=2))
+    results = list(map_in_pool(evaluate_worker_pair, worker_pairs, {'worker_indices': worker_indices}, workers))
+
+    rows = [(w1, w2, n_shared, *counts) for (w1, w2), (n_shared, counts) in zip(worker_pairs, results)]
+    pairs_df = pd.DataFrame(rows, columns=['worker_1', 'worker_2', 'n_predicates'] + COUNT_COLUMNS)
+    pairs_df['f1'] = [f1_score(*counts) for counts in zip(pairs_df.arg_tp, pairs_df.arg_fp, pairs_df.arg_fn)]
+    pairs_df['label_f1'] = [f1_score(*counts) for counts
+                            in zip(pairs_df.label_arg_tp, pairs_df.label_arg_fp, pairs_df.label_arg_fn)]
+    return pairs_df
+
+
+def agreement_matrix(pairs_df: pd.DataFrame, value: str = 'f1') -> pd.DataFrame:
+    # Symmetric worker x worker matrix of a pairwise score, pairs without shared predicates are NaN
+    workers = sorted(set(pairs_df.worker_1) | set(pairs_df.worker_2))
+    matrix = pd.DataFrame(np.nan, index=workers, columns=workers)
+    scores = pairs_df[value].where(pairs_df.n_predicates > 0)
+    for w1, w2, score in zip(pairs_df.worker_1, pairs_df.worker_2, scores):
+        matrix.loc[w1, w2] = matrix.loc[w2, w1] = score
+    return matrix
+
+
+def evaluate_generator_agreement(annot_df: pd.DataFrame, sent_map: Dict[str, List[str]], n_processes: int = 1):
     cols = ['qasrl_id', 'verb_idx']
-    n_gen = annot_df.groupby(cols).worker_id.transform(pd.Series.nunique)
+    n_gen = annot_df.groupby(cols, observed=True).worker_id.transform(pd.Series.nunique)
     workers = annot_df.worker_id.unique().tolist()
     n_workers = len(workers)
     annot_df = annot_df[n_gen == n_workers].copy()
@@ -67,15 +133,11 @@ def evaluate_generator_agreement(annot_df: pd.DataFrame, sent_map: Dict[str, Lis
     f1s, label_f1s = [], []
     uniq_roles_per_predicate = []
     agreed_roles_per_predicate = []
-    for w1, w2 in combinations(workers, r=2):
-        w1_df = annot_df[annot_df.worker_id == w1].copy()
-        w2_df = annot_df[annot_df.worker_id == w2].copy()
-        # n_matches, n_total = eval_datasets_for_agreement(w1_df, w2_df)
-        # uniq_roles_per_predicate.append(float(n_total)/n_predicates)
-        # agreed_roles_per_predicate.append(float(n_matches)/n_predicates)
-        #
-        #
-        arg_metrics, label_arg_metrics, _ = eval_datasets(w1_df, w2_df)
+    pairs_df = evaluate_pairwise_agreement(annot_df, n_processes)
+    for row in pairs_df.itertuples(index=False):
+        w1, w2 = row.worker_1, row.worker_2
+        arg_metrics = Metrics(row.arg_tp, row.arg_fp, row.arg_fn)
+        label_arg_metrics = Metrics(row.label_arg_tp, row.label_arg_fp, row.label_arg_fn)
         print(f"{w1}\t{w2}\t{arg_metrics.prec()}\t{arg_metrics.recall()}\t{arg_metrics.f1()}")
         print(f"{w1}\t{w2}\t{label_arg_metrics.prec()}\t{label_arg_metrics.recall()}\t{label_arg_metrics.f1()}")
 
@@ -85,6 +147,7 @@ def evaluate_generator_agreement(annot_df: pd.DataFrame, sent_map: Dict[str, Lis
     label_f1s = np.array(label_f1s)
     print(f1s.mean(), f1s.std())
     print(label_f1s.mean(), label_f1s.std())
+    return pairs_df
 
     # agreed_roles_per_predicate = np.array(agreed_roles_per_predicate)
     # print(agreed_roles_per_predicate.mean(), agreed_roles_per_predicate.std())
@@ -108,16 +171,24 @@ def dataset_path(root_dir: str, dataset_name: str,
     return slice_path
 
 
-def main(root_dir: str, dataset_name: str):
+def main(root_dir: str, dataset_name: str, use_cache: bool = False, workers: int = 1, out_dir: str = None):
     readme = pd.read_csv(os.path.join(root_dir, 'readme.csv'))
     sent_path = os.path.join(root_dir, f'{dataset_name}.csv')
     sent_df = read_csv(sent_path)
     sent_map = dict(zip(sent_df.qasrl_id, sent_df.tokens.apply(str.split)))
     # original annotations, multiple generation tasks per predicate
-    annot_df = read_csv(os.path.join(root_dir, f'{dataset_name}.annot.csv'))
-    annot_df = decode_qasrl(annot_df)
+    annot_df = load_qasrl(os.path.join(root_dir, f'{dataset_name}.annot.csv'), use_cache, read_fn=read_csv)
     print(annot_df.worker_id.value_counts())
-    evaluate_generator_agreement(annot_df, sent_map)
+    pairs_df = evaluate_generator_agreement(annot_df, sent_map, workers)
+    for value in AGREEMENT_MATRIX_VALUES:
+        matrix = agreement_matrix(pairs_df, value)
+        print(f"{value} agreement matrix")
+        with pd.option_context('display.max_columns', None, 'display.width', 250, 'display.precision', 4):
+            print(matrix)
+        if out_dir is not None:
+            matrix_path = os.path.join(out_dir, f"{dataset_name}.agreement_{value}.csv")
+            matrix.to_csv(matrix_path, encoding="utf-8")
+            print(matrix_path)
 
     slice_pairs = []
     for arbitrators_, generators_ in zip(readme.arbitrators, readme.generators):
@@ -125,8 +196,8 @@ def main(root_dir: str, dataset_name: str):
         gen1, gen2, gen3, gen4 = generators_.split()
         slice1_path = dataset_path(root_dir, dataset_name, gen1, gen2, arb1)
         slice2_path = dataset_path(root_dir, dataset_name, gen3, gen4, arb2)
-        slice1 = decode_qasrl(pd.read_csv(slice1_path))
-        slice2 = decode_qasrl(pd.read_csv(slice2_path))
+        slice1 = load_qasrl(slice1_path, use_cache)
+        slice2 = load_qasrl(slice2_path, use_cache)
         # make sure they have the same predicates...
         s1 = set(zip(slice1.qasrl_id, slice1.verb_idx))
         s2 = set(zip(slice2.qasrl_id, slice2.verb_idx))
@@ -141,5 +212,9 @@ if __name__ == "__main__":
     ap = ArgumentParser()
     ap.add_argument("inter_annotator_dir")
     ap.add_argument("dataset_name")
+    ap.add_argument("--cache", action="store_true", help="Load decoded datasets from a binary cache next to each CSV")
+    ap.add_argument("--workers", type=int, default=1, help="Number of processes used to score pairs of workers")
+    ap.add_argument("--out_dir", required=False,
+                    help="Also save the worker x worker F1 and labeled F1 matrices as CSV files in this directory")
     args = ap.parse_args()
-    main(args.inter_annotator_dir, args.dataset_name)
+    main(args.inter_annotator_dir, args.dataset_name, args.cache, args.workers, args.out_dir)
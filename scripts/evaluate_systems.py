@@ -0,0 +1,105 @@
+import glob
+import os
+from argparse import ArgumentParser
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from dataset_cache import load_qasrl
+from evaluate import MATCHING_BACKENDS, MATCHING_BACKEND
+from evaluate_dataset import PredicateIndex, COUNT_COLUMNS, POOL_STATE, eval_datasets, write_alignment, \
+    get_alignment_path, map_in_pool
+from sentence_store import load_sentences
+from significance import prf_from_counts
+
+# Ranks several system outputs against one reference. The reference (and the sentences) are loaded
+# and indexed once, and shared by every evaluation, or by every pool process when running in parallel.
+SCORE_PREFIXES = ['arg', 'label_arg', 'role']
+
+
+def expand_system_paths(paths: List[str]) -> List[str]:
+    # Glob patterns are expanded here as well, for shells that pass them through.
+    # Alignment files written next to the system files of an earlier run are not system outputs.
+    expanded = []
+    for path in paths:
+        matches = [match for match in sorted(glob.glob(path)) if not match.endswith(".align.csv")] \
+            if glob.has_magic(path) else [path]
+        expanded.extend(match for match in matches if match not in expanded)
+    return expanded
+
+
+def evaluate_system(sys_path: str) -> Tuple[str, List[int]]:
+    grt_index = POOL_STATE['grt_index']
+    include_sys_only = POOL_STATE['include_sys_only']
+    matching_backend = POOL_STATE['matching_backend']
+    sys_index = PredicateIndex(load_qasrl(sys_path, POOL_STATE['use_cache']))
+    metrics = eval_datasets(grt_index, sys_index, include_sys_only, matching_backend)
+    if POOL_STATE['sent_map'] is not None:
+        align_path = get_alignment_path(sys_path, POOL_STATE['reference_path'])
+        write_alignment(align_path, sys_index, grt_index, POOL_STATE['sent_map'], include_sys_only,
+                        matching_backend)
+    return sys_path, [count for metric in metrics for count in metric.as_tuple()]
+
+
+def build_leaderboard(system_counts: List[Tuple[str, List[int]]], sort_by: str = 'label_arg_f1') -> pd.DataFrame:
+    counts = np.array([counts for _, counts in system_counts], dtype=np.int64).reshape(-1, len(COUNT_COLUMNS))
+    leaderboard = scores_frame(counts)
+    leaderboard.insert(0, 'system', [os.path.basename(sys_path) for sys_path, _ in system_counts])
+    return leaderboard.sort_values(sort_by, ascending=False, kind="mergesort").reset_index(drop=True)
+
+
+def scores_frame(counts: np.ndarray) -> pd.DataFrame:
+    # One row per row of counts (in the order of COUNT_COLUMNS), with TP/FP/FN and P/R/F1 of each metric
+    scores = prf_from_counts(counts)
+    frame = pd.DataFrame(counts, columns=COUNT_COLUMNS)
+    for metric_idx, prefix in enumerate(SCORE_PREFIXES):
+        for score_idx, score_name in enumerate(['prec', 'recall', 'f1']):
+            frame[f"{prefix}_{score_name}"] = scores[:, metric_idx, score_idx]
+    columns = [f"{prefix}_{field}" for prefix in SCORE_PREFIXES
+               for field in ['tp', 'fp', 'fn', 'prec', 'recall', 'f1']]
+    return frame[columns]
+
+
+def main(reference_path: str, sys_paths: List[str], sents_path: str = None, include_sys_only: bool = False,
+         matching_backend: str = None, workers: int = 1, use_cache: bool = False,
+         out_path: str = None, sort_by: str = 'label_arg_f1'):
+    sys_paths = expand_system_paths(sys_paths)
+    if not sys_paths:
+        raise ValueError("No system files found")
+    grt_index = PredicateIndex(load_qasrl(reference_path, use_cache))
+    sent_map = load_sentences(sents_path, use_cache) if sents_path is not None else None
+
+    pool_state = {'grt_index': grt_index, 'reference_path': reference_path, 'sent_map': sent_map,
+                  'include_sys_only': include_sys_only, 'matching_backend': matching_backend, 'use_cache': use_cache}
+    system_counts = list(map_in_pool(evaluate_system, sys_paths, pool_state, workers))
+
+    leaderboard = build_leaderboard(system_counts, sort_by)
+    with pd.option_context('display.max_columns', None, 'display.width', 250, 'display.precision', 4):
+        print(leaderboard.to_string(index=False))
+    if out_path is not None:
+        leaderboard.to_csv(out_path, index=False, encoding="utf-8")
+        print(out_path)
+    return leaderboard
+
+
+if __name__ == "__main__":
+    ap = ArgumentParser()
+    ap.add_argument("ground_truth_path")
+    ap.add_argument("sys_paths", nargs="+", help="System output CSV files or glob patterns")
+    ap.add_argument("-s", "--sentences_path", required=False,
+                    help="Also write the alignment file of every system next to its CSV")
+    ap.add_argument("--include_sys_only", action="store_true",
+                    help="Score predicates that appear only in the system output instead of ignoring them")
+    ap.add_argument("--matcher", choices=MATCHING_BACKENDS, default=MATCHING_BACKEND,
+                    help="Algorithm used to align system and gold arguments one to one")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="Number of processes, each one evaluates a whole system")
+    ap.add_argument("--cache", action="store_true",
+                    help="Load decoded datasets from a binary cache next to each CSV, building it if needed, "
+                         "and the sentences from a memory mapped store")
+    ap.add_argument("--out", required=False, help="/path/to/leaderboard.csv")
+    ap.add_argument("--sort_by", default="label_arg_f1", help="Leaderboard column to rank the systems by")
+    args = ap.parse_args()
+    main(args.ground_truth_path, args.sys_paths, args.sentences_path, args.include_sys_only, args.matcher,
+         args.workers, args.cache, args.out, args.sort_by)
@@ -1,62 +1,133 @@
 from argparse import ArgumentParser
+from collections import defaultdict
+from typing import Dict, List, Tuple
 import pandas as pd
-from decode_encode_answers import decode_qasrl
-from evaluate_dataset import eval_datasets
+from dataset_cache import load_qasrl
+from evaluate_dataset import PredicateIndex, index_by_worker, evaluate_counts, sum_counts, align_predicate, \
+    chunked, map_in_pool, ALIGNMENT_COLUMNS, POOL_STATE
+from sentence_store import load_sentences
 import os
 
+PREDICATE_CHUNK_SIZE = 64
+REPORT_FLUSH_ROWS = 5000
+
+
 def parse_args():
     ap = ArgumentParser()
     ap.add_argument("qasrl_path", help="/path/to/qasrl_annotation_output.csv")
     ap.add_argument("ref_path", help="/path/to/qasrl_ground_truth.csv")
     ap.add_argument("sent_path", help="/path/to/sentences.csv")
     ap.add_argument("out_dir", help="/path/to/directory_where_a_report_for_each_worker_is_saved")
+    ap.add_argument("--cache", action="store_true", help="Load decoded datasets from a binary cache next to each CSV, "
+                                                         "and the sentences from a memory mapped store")
+    ap.add_argument("--workers", type=int, default=1, help="Number of processes used to score predicates")
     return ap.parse_args()
 
 
+class WorkerReports:
+    # Buffers the match table rows of each worker and appends them to the worker's CSV
+    # once the buffer is large enough, so memory stays bounded by flush_rows per worker.
+    def __init__(self, out_dir: str, flush_rows: int = REPORT_FLUSH_ROWS):
+        self.out_dir = out_dir
+        self.flush_rows = flush_rows
+        self.buffers: Dict[str, List[pd.DataFrame]] = defaultdict(list)
+        self.n_buffered: Dict[str, int] = defaultdict(int)
+        self.n_written: Dict[str, int] = defaultdict(int)
+
+    def add(self, worker_id: str, matches: pd.DataFrame):
+        self.buffers[worker_id].append(matches)
+        self.n_buffered[worker_id] += len(matches)
+        if self.n_buffered[worker_id] >= self.flush_rows:
+            self.flush(worker_id)
+
+    def flush(self, worker_id: str):
+        if not self.buffers[worker_id]:
+            return
+        matches = pd.concat(self.buffers[worker_id])[ALIGNMENT_COLUMNS]
+        worker_path = os.path.join(self.out_dir, f"{worker_id}.csv")
+        is_first = self.n_written[worker_id] == 0
+        matches.to_csv(worker_path, mode="w" if is_first else "a", header=is_first,
+                       index=False, encoding="utf-8")
+        self.n_written[worker_id] += len(matches)
+        self.buffers[worker_id] = []
+        self.n_buffered[worker_id] = 0
+
+    def close(self):
+        for worker_id in list(self.buffers):
+            self.flush(worker_id)
+
+
+def evaluate_predicate_chunk(keys: List[Tuple[str, int]]) -> List[Tuple[str, List[int], int, pd.DataFrame]]:
+    # Every worker who annotated a gold predicate is scored against the same gold roles
+    ref_index, worker_indices = POOL_STATE['ref_index'], POOL_STATE['worker_indices']
+    results = []
+    for key in keys:
+        grt_roles = ref_index.roles(key)
+        tokens = POOL_STATE['sent_map'][key[0]]
+        for worker_id in POOL_STATE['predicate_workers'].get(key, []):
+            sys_roles = worker_indices[worker_id].roles(key)
+            counts = evaluate_counts(sys_roles, grt_roles)
+            n_questions = len(set(role.question for role in sys_roles))
+            matches = align_predicate(key, sys_roles, grt_roles, tokens)
+            results.append((worker_id, counts, n_questions, matches))
+    return results
+
+
+def evaluate_workers(qasrl: pd.DataFrame, ref: pd.DataFrame, sent_map: Dict[str, List[str]],
+                     reports: WorkerReports, workers: int = 1) -> pd.DataFrame:
+    # A single pass over the gold predicates scores all workers at once
+    ref_index = PredicateIndex(ref)
+    worker_indices = index_by_worker(qasrl)
+    predicate_workers = defaultdict(list)
+    for worker_id, worker_index in worker_indices.items():
+        for key in worker_index.keys():
+            predicate_workers[key].append(worker_id)
+
+    keys = [key for key in ref_index.keys() if key in predicate_workers]
+    pool_state = {'ref_index': ref_index, 'worker_indices': worker_indices,
+                  'predicate_workers': predicate_workers, 'sent_map': sent_map}
+    worker_counts = defaultdict(lambda: [0] * 9)
+    worker_n_preds = defaultdict(int)
+    worker_n_questions = defaultdict(int)
+
+    key_chunks = list(chunked(keys, PREDICATE_CHUNK_SIZE))
+    for results in map_in_pool(evaluate_predicate_chunk, key_chunks, pool_state, workers):
+        for worker_id, counts, n_questions, matches in results:
+            worker_counts[worker_id] = sum_counts([worker_counts[worker_id], counts])
+            worker_n_preds[worker_id] += 1
+            worker_n_questions[worker_id] += n_questions
+            reports.add(worker_id, matches)
+    reports.close()
+
+    worker_data = []
+    for worker_id, counts in worker_counts.items():
+        tp, fp, fn = counts[0:3]
+        worker_data.append({
+            "worker_id": worker_id,
+            "prec": tp / (tp + fp) if tp + fp else float("nan"),
+            "recall": tp / (tp + fn) if tp + fn else float("nan"),
+            "n_preds": worker_n_preds[worker_id],
+            "qs_per_pred": float(worker_n_questions[worker_id]) / worker_n_preds[worker_id]})
+    columns = ['worker_id', 'n_preds', 'qs_per_pred', 'prec', 'recall']
+    return pd.DataFrame(worker_data, columns=columns)
+
+
 def main():
     args = parse_args()
     qasrl_path = args.qasrl_path
     out_dir = args.out_dir
 
-    qasrl = decode_qasrl(pd.read_csv(qasrl_path))
-    ref = decode_qasrl(pd.read_csv(args.ref_path))
-    sents = pd.read_csv(args.sent_path)
-    sent_map = dict(zip(sents.qasrl_id, sents.tokens.apply(str.split)))
+    qasrl = load_qasrl(qasrl_path, args.cache)
+    ref = load_qasrl(args.ref_path, args.cache)
+    sent_map = load_sentences(args.sent_path, args.cache)
 
-    worker_data = []
-    # Step 1: get a dataset for each worker
-    work_groups = qasrl.groupby("worker_id")
-    for worker_id, worker_df in work_groups:
-        print(f"Evaluating: {worker_id}")
-        # Step 2: for each worker, compare the dataset
-        # with the reference on common predicate ids.
-        w_pred_ids = worker_df[['qasrl_id', 'verb_idx']].drop_duplicates()
-        w_ref = pd.merge(ref, w_pred_ids, on=['qasrl_id', 'verb_idx'])
-        res = eval_datasets(w_ref, worker_df)
-
-        # Step 3: for each worker, get argument precision and recall, and avg. number of questions per verb.
-        arg_counts, role_counts, all_matchings = res
-        tp, fp, fn = arg_counts
-        prec = tp / (tp + fp)
-        recall = tp / (tp + fn)
-        n_questions = all_matchings.sys_role.nunique()
-        n_predicates = w_pred_ids.shape[0]
-        qs_per_pred = float(n_questions)/n_predicates
-        worker_path = os.path.join(out_dir, f"{worker_id}.csv")
-
-        # Step 5: save report.
-        all_matchings.to_csv(worker_path, index=False, encoding="utf-8")
-        worker_data.append({
-            "worker_id": worker_id,
-            "prec": prec,
-            "recall": recall,
-            "n_preds": n_predicates,
-            "qs_per_pred": qs_per_pred})
-    worker_data = pd.DataFrame(worker_data)[['worker_id', 'n_preds', 'qs_per_pred', 'prec', 'recall']].copy()
+    # Step 1: score every worker on the gold predicates they annotated, writing a report for each worker.
+    # Step 2: for each worker, get argument precision and recall, and avg. number of questions per verb.
+    worker_data = evaluate_workers(qasrl, ref, sent_map, WorkerReports(out_dir), args.workers)
 
-    # Step 4: display result
+    # Step 3: display result
     print(worker_data.sort_values(['n_preds', 'qs_per_pred'], ascending=False))
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
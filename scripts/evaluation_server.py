@@ -0,0 +1,258 @@
+import glob
+import io
+import json
+import os
+import signal
+import socketserver
+import sys
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Pool
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+from convert_parser_to_csv import parser_roles_frame, roles_from_lines
+from dataset_cache import load_qasrl
+from decode_encode_answers import decode_qasrl
+from evaluate import MATCHING_BACKENDS, MATCHING_BACKEND
+from evaluate_dataset import PredicateIndex, POOL_STATE, init_pool_process, yield_predicate_counts, sum_counts, \
+    write_alignment_csv
+from evaluate_systems import scores_frame
+from interning import intern_columns
+from paraphrases import PARAPHRASE_CLASSES
+from sentence_store import STORE_SUFFIX, load_sentences
+
+# Evaluation server for jobs that score many system outputs, e.g. a checkpoint every few minutes.
+# The gold sets (and their sentences) are loaded and indexed once at startup, and every request is
+# scored by a pool of processes that inherit them, while a thread per connection waits for its result.
+# Serves HTTP on localhost or on a Unix socket:
+#   GET  /gold                   names of the loaded gold sets (the gold file name without .csv)
+#   POST /evaluate?gold=NAME     system output in the body, returns the metrics as JSON
+#        format=csv|jsonl        a QA-SRL CSV (default) or the parser JSON lines of convert_parser_to_csv.py
+#        min_score=T             spans of a jsonl payload are kept when their score is above T (default 0)
+#        include_sys_only=1      count the predicates found only in the system output as false positives
+#        matcher=NAME            one of MATCHING_BACKENDS
+#        align=1                 also return the alignment file, needs the sentences of the gold set
+# e.g. curl --unix-socket /tmp/qasrl_eval.sock --data-binary @sys.csv "http://localhost/evaluate?gold=wikinews.dev.gold"
+# Sentence files are matched to the gold sets sharing their first two name parts (wikinews.dev.*).
+
+
+def find_csv_files(paths: List[str]) -> List[str]:
+    # Files, directories (every CSV in them, sentence stores are kept as they are) or glob patterns
+    found = []
+    for path in paths:
+        if os.path.isdir(path) and not path.rstrip("/").endswith(STORE_SUFFIX):
+            matches = sorted(glob.glob(os.path.join(path, "*.csv")))
+        elif glob.has_magic(path):
+            matches = sorted(glob.glob(path))
+        else:
+            matches = [path]
+        found.extend(match for match in matches if match not in found)
+    return found
+
+
+def gold_name(gold_path: str) -> str:
+    return os.path.splitext(os.path.basename(gold_path))[0]
+
+
+def dataset_prefix(path: str) -> str:
+    return ".".join(os.path.basename(path).split(".")[:2])
+
+
+def load_gold_sets(gold_paths: List[str], sents_paths: List[str], use_cache: bool = False):
+    gold_indices = {gold_name(gold_path): PredicateIndex(load_qasrl(gold_path, use_cache))
+                    for gold_path in gold_paths}
+    sent_maps = {}
+    for sents_path in sents_paths:
+        sent_map = load_sentences(sents_path, use_cache)
+        for name in gold_indices:
+            if dataset_prefix(name) == dataset_prefix(sents_path):
+                sent_maps[name] = sent_map
+    return gold_indices, sent_maps
+
+
+def init_server_pool(gold_indices: Dict[str, PredicateIndex], sent_maps: Dict[str, object],
+                     class_ids: Dict[tuple, int]):
+    init_pool_process({'gold_indices': gold_indices, 'sent_maps': sent_maps}, class_ids, False)
+    # Classes that only appear in payloads are forgotten after each request, so a long running
+    # server does not keep every question it has seen
+    POOL_STATE['n_gold_classes'] = len(PARAPHRASE_CLASSES.class_ids)
+
+
+def read_payload(payload: bytes, payload_format: str, min_score: float = 0.0) -> pd.DataFrame:
+    if payload_format == "csv":
+        return intern_columns(decode_qasrl(pd.read_csv(io.BytesIO(payload))))
+    if payload_format == "jsonl":
+        lines = payload.decode("utf-8").splitlines()
+        return intern_columns(parser_roles_frame(roles_from_lines(lines, min_score)))
+    raise ValueError(f"Unknown payload format: {payload_format}")
+
+
+def evaluate_payload(request: dict) -> dict:
+    try:
+        return evaluate_request(request)
+    finally:
+        PARAPHRASE_CLASSES.truncate(POOL_STATE['n_gold_classes'])
+
+
+def evaluate_request(request: dict) -> dict:
+    grt_index = POOL_STATE['gold_indices'][request['gold']]
+    sys_index = PredicateIndex(read_payload(request['payload'], request['format'], request['min_score']))
+    include_sys_only, matching_backend = request['include_sys_only'], request['matcher']
+    counts = sum_counts(counts for _, counts
+                        in yield_predicate_counts(grt_index, sys_index, include_sys_only, matching_backend))
+    scores = scores_frame(np.array([counts], dtype=np.int64)).to_dict('records')[0]
+    response = {'gold': request['gold'],
+                'n_sys_predicates': len(sys_index),
+                'n_sys_only_predicates': sum(1 for key in sys_index.keys() if key not in grt_index),
+                'scores': {name: None if pd.isnull(value) else value for name, value in scores.items()}}
+    if request['align']:
+        sent_map = POOL_STATE['sent_maps'].get(request['gold'])
+        if sent_map is None:
+            raise ValueError(f"No sentences were loaded for {request['gold']}")
+        fout = io.StringIO()
+        # A progress bar per request would only fill the server log
+        write_alignment_csv(fout, sys_index, grt_index, sent_map, include_sys_only, matching_backend, progress=False)
+        response['alignment'] = fout.getvalue()
+    return response
+
+
+def is_true(value: str) -> bool:
+    return value.lower() in ("1", "true", "yes")
+
+
+class EvaluationHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if urlparse(self.path).path != "/gold":
+            return self.send_json(404, {'error': f"Unknown path {self.path}"})
+        gold = {name: {'n_predicates': n_predicates, 'has_sentences': name in self.server.sent_map_names}
+                for name, n_predicates in self.server.gold_sizes.items()}
+        self.send_json(200, {'gold': gold})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/evaluate":
+            # The body is not read, so the connection cannot be reused
+            self.close_connection = True
+            return self.send_json(404, {'error': f"Unknown path {url.path}"})
+        if 'Content-Length' not in self.headers:
+            self.close_connection = True
+            return self.send_json(411, {'error': "Missing Content-Length header"})
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            payload = self.rfile.read(self.content_length())
+            request = self.parse_request_params(params, payload)
+        except ValueError as e:
+            self.close_connection = True
+            return self.send_json(400, {'error': str(e)})
+        if request['gold'] not in self.server.gold_sizes:
+            return self.send_json(404, {'error': f"Unknown gold set {request['gold']}"})
+        try:
+            response = self.server.pool.apply(evaluate_payload, (request,))
+        except (ValueError, KeyError, UnicodeDecodeError, pd.errors.ParserError, json.JSONDecodeError) as e:
+            return self.send_json(400, {'error': f"{type(e).__name__}: {e}"})
+        except Exception as e:
+            return self.send_json(500, {'error': f"{type(e).__name__}: {e}"})
+        self.send_json(200, response)
+
+    def content_length(self) -> int:
+        content_length = self.headers['Content-Length']
+        if not content_length.strip().isdigit():
+            raise ValueError(f"Invalid Content-Length header {content_length!r}")
+        return int(content_length)
+
+    def parse_request_params(self, params: Dict[str, str], payload: bytes) -> dict:
+        if 'gold' not in params:
+            raise ValueError("Missing gold parameter")
+        matcher = params.get('matcher', MATCHING_BACKEND)
+        if matcher not in MATCHING_BACKENDS:
+            raise ValueError(f"Unknown matcher {matcher}, expected one of {', '.join(MATCHING_BACKENDS)}")
+        return {'gold': params['gold'],
+                'payload': payload,
+                'format': params.get('format', "csv"),
+                'min_score': float(params.get('min_score', 0.0)),
+                'include_sys_only': is_true(params.get('include_sys_only', "")),
+                'matcher': matcher,
+                'align': is_true(params.get('align', ""))}
+
+    def send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self) -> str:
+        # Clients of a Unix socket have no address
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(address: str, port: int, socket_path: Optional[str]):
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        return UnixHTTPServer(socket_path, EvaluationHandler)
+    return ThreadingHTTPServer((address, port), EvaluationHandler)
+
+
+def main(gold_paths: List[str], sents_paths: List[str] = (), socket_path: str = None, address: str = "127.0.0.1",
+         port: int = 8765, workers: int = 1, use_cache: bool = False, verbose: bool = False):
+    gold_paths = find_csv_files(gold_paths)
+    if not gold_paths:
+        raise ValueError("No gold files found")
+    gold_indices, sent_maps = load_gold_sets(gold_paths, find_csv_files(sents_paths), use_cache)
+    for name, index in gold_indices.items():
+        print(f"{name}: {len(index)} predicates{', with sentences' if name in sent_maps else ''}")
+
+    pool = Pool(workers, initializer=init_server_pool,
+                initargs=(gold_indices, sent_maps, dict(PARAPHRASE_CLASSES.class_ids)))
+    server = make_server(address, port, socket_path)
+    server.pool = pool
+    server.gold_sizes = {name: len(index) for name, index in gold_indices.items()}
+    server.sent_map_names = set(sent_maps)
+    server.verbose = verbose
+    # Stopped by a service manager as by Ctrl-C, so that the pool is shut down and the socket removed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"Listening on {socket_path or f'http://{address}:{port}'}", flush=True)
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.server_close()
+        pool.terminate()
+        pool.join()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+if __name__ == "__main__":
+    ap = ArgumentParser()
+    ap.add_argument("gold_paths", nargs="+", help="Gold CSV files, directories of them or glob patterns")
+    ap.add_argument("-s", "--sentences_paths", nargs="+", default=[],
+                    help="Sentence CSV files or directories, needed to return alignments")
+    ap.add_argument("--socket", required=False, help="Listen on this Unix socket instead of localhost")
+    ap.add_argument("--address", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--workers", type=int, default=1, help="Number of processes scoring requests")
+    ap.add_argument("--cache", action="store_true",
+                    help="Load decoded datasets from a binary cache next to each CSV, building it if needed, "
+                         "and the sentences from a memory mapped store")
+    ap.add_argument("--verbose", action="store_true", help="Log every request")
+    args = ap.parse_args()
+    main(args.gold_paths, args.sentences_paths, args.socket, args.address, args.port, args.workers, args.cache,
+         args.verbose)
@@ -0,0 +1,41 @@
+import sys
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+# Repeated string columns of the QA-SRL datasets are held as pandas categoricals, one integer code per row
+# and every distinct value stored once, so grouping, merging and deduplicating them works on the codes.
+# Categories are sorted, so groups and sorts on the codes follow the order of the strings, and they are
+# interned with sys.intern: equal values of different datasets are then the same str object, and the
+# dict and set lookups of the evaluation short cut on identity.
+# Values are mapped back to strings only on output (to_csv writes the values) or when building Questions.
+# Groupbys on these columns take observed=True, otherwise pandas builds every combination of categories.
+INTERNED_COLUMNS = ['qasrl_id', 'worker_id', 'assign_id', 'source_assign_id', 'verb', 'question',
+                    'wh', 'subj', 'obj', 'aux', 'prep', 'obj2', 'verb_prefix', 'verb_slot_inflection']
+
+
+def intern_columns(qasrl_df: pd.DataFrame, columns: Iterable[str] = INTERNED_COLUMNS) -> pd.DataFrame:
+    for col in columns:
+        if col in qasrl_df and qasrl_df[col].dtype == object:
+            qasrl_df[col] = intern_values(qasrl_df[col])
+    return qasrl_df
+
+
+def intern_values(values: pd.Series) -> pd.Categorical:
+    codes, uniques = pd.factorize(values)
+    return intern_codes(codes, np.asarray(uniques, dtype=object))
+
+
+def intern_codes(codes: np.ndarray, vocab: np.ndarray) -> pd.Categorical:
+    # Missing values have code -1. A vocabulary of mixed types, which cannot be sorted, keeps its order.
+    vocab = np.array([sys.intern(value) if type(value) is str else value for value in vocab], dtype=object)
+    try:
+        order = np.argsort(vocab, kind="stable")
+    except TypeError:
+        order = np.arange(len(vocab))
+    ranks = np.empty(len(vocab), dtype=np.int64)
+    ranks[order] = np.arange(len(vocab))
+    codes = np.asarray(codes)
+    sorted_codes = np.where(codes >= 0, ranks[np.maximum(codes, 0)], -1) if len(vocab) else codes
+    return pd.Categorical.from_codes(sorted_codes, categories=pd.Index(vocab[order], dtype=object))
@@ -1,4 +1,5 @@
 from collections import namedtuple
+from typing import Dict, Hashable, Tuple
 
 import pandas as pd
 import numpy as np
@@ -26,6 +27,93 @@ def is_paraphrase(q1: Question, q2: Question):
     return all(eqs)
 
 
+class ParaphraseClasses:
+    # Assigns an integer id to every paraphrase class, so that two questions are
+    # paraphrases exactly when their class ids are equal.
+    # A class is keyed on the normalized (wh, subj, obj, is_passive, is_negated) slots of a question,
+    # questions without a parsed wh slot fall back to their lowercased text.
+    # Questions with the same text are expected to have the same slots.
+    def __init__(self):
+        self.class_ids: Dict[Hashable, int] = {}
+
+    def class_id_of_key(self, key: Tuple) -> int:
+        return self.class_ids.setdefault(key, len(self.class_ids))
+
+    def truncate(self, n_classes: int):
+        # Forgets every class assigned after the first n_classes. Classes are only ever added,
+        # so they are the last items of the dict.
+        while len(self.class_ids) > n_classes:
+            self.class_ids.popitem()
+
+    def class_id(self, question) -> int:
+        return self.class_id_of_key(paraphrase_key(question.text, question.wh, question.subj, question.obj,
+                                                   question.is_passive, question.is_negated))
+
+    def class_ids_of_frame(self, questions_df: pd.DataFrame) -> np.ndarray:
+        # One id per row, the class of each distinct slot tuple is looked up only once.
+        # Rows are grouped on integer codes of the normalized slots, so interned columns are never expanded.
+        fields = {field: normalized_codes(questions_df[field], lower=(field == 'wh')) for field in QUESTION_FIELDS}
+        fields['text'] = normalized_codes(questions_df.question, lower=True)
+        wh_codes, wh_values = fields['wh']
+        has_wh = wh_values[wh_codes] != ""
+        # Questions with a wh slot are keyed on their slots only, the others on their text only
+        key_codes = {}
+        for field, (codes, values) in fields.items():
+            is_blank = ~has_wh if field in QUESTION_FIELDS else has_wh
+            key_codes[field] = np.where(is_blank, blank_code(values), codes)
+        key_df = pd.DataFrame(key_codes)
+        group_idx = key_df.groupby(list(key_codes), sort=False).ngroup().values
+        first_rows = np.unique(group_idx, return_index=True)[1]
+        key_fields = ['text', 'wh', 'subj', 'obj', 'is_passive', 'is_negated']
+        first_values = [fields[field][1][key_df[field].values[first_rows]] for field in key_fields]
+        group_class_ids = np.array([self.class_id_of_key(paraphrase_key(*values)) for values in zip(*first_values)],
+                                   dtype=np.int64)
+        return group_class_ids[group_idx]
+
+
+def normalized_codes(values: pd.Series, lower: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    # Code of every row and the distinct normalized strings they point to: missing values become "",
+    # other values their str (lowercased with lower), and values equal after normalization share a code
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes, uniques = values.cat.codes.values, values.cat.categories
+    else:
+        codes, uniques = pd.factorize(values)
+    normalized = pd.Series(uniques, dtype=object).astype(str)
+    if lower:
+        normalized = normalized.str.lower()
+    # Missing values have code -1, which picks the "" appended last
+    normalized = np.append(normalized.values.astype(object), "")
+    normalized_codes, normalized_values = pd.factorize(normalized)
+    return normalized_codes[codes], np.asarray(normalized_values, dtype=object)
+
+
+def blank_code(values: np.ndarray) -> int:
+    return int(np.flatnonzero(values == "")[0])
+
+
+def paraphrase_key(text, wh, subj, obj, is_passive, is_negated) -> Tuple:
+    if pd.isnull(wh) or wh == "":
+        return ("text", str(text).lower())
+    slots = ["" if pd.isnull(slot) else str(slot) for slot in (subj, obj, is_passive, is_negated)]
+    return ("slots", str(wh).lower(), *slots)
+
+
+PARAPHRASE_CLASSES = ParaphraseClasses()
+
+
+def init_paraphrase_classes(class_ids: Dict[Hashable, int]):
+    # Called by pool initializers with the class ids of the parent process. Questions evaluated in the pool
+    # must get the class ids of the gold questions, which processes that were not forked do not inherit.
+    PARAPHRASE_CLASSES.class_ids.update(class_ids)
+
+
+def paraphrase_class_id(question) -> int:
+    class_id = getattr(question, 'paraphrase_id', None)
+    if class_id is None:
+        class_id = PARAPHRASE_CLASSES.class_id(question)
+    return class_id
+
+
 def load_parsed_questions(questions_path):
     parsed_questions = pd.read_csv(questions_path)
     cols = ['qasrl_id', 'verb_idx', 'question', 'source_assign_id'] + QUESTION_FIELDS
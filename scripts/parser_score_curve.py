@@ -0,0 +1,94 @@
+from argparse import ArgumentParser
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from convert_parser_to_csv import CSV_COLUMNS, iter_records, parser_roles_frame, yield_scored_roles_from_parser
+from dataset_cache import load_qasrl
+from evaluate import evaluate_score_thresholds
+from evaluate_dataset import PredicateIndex, COUNT_COLUMNS, EVAL_CHUNK_SIZE, POOL_STATE, sum_chunk_counts, \
+    yield_paired_keys
+from evaluate_systems import scores_frame
+from interning import intern_columns
+
+# Precision/recall curve of a parser over its span scores, from a single read of the parser JSONL.
+# Same metrics as convert_parser_to_csv.py --min_score T followed by evaluate_dataset.py for every T,
+# without writing the intermediate CSVs: each span keeps its score, and the IoU matrices of every
+# predicate are computed once over all of its spans.
+DEFAULT_MIN_SCORES = [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]
+
+
+def load_scored_parser(parser_path: str) -> Tuple[pd.DataFrame, np.ndarray]:
+    # Roles of the parser with all their spans, as decode_qasrl would return them,
+    # and the span scores of every row
+    items = yield_scored_roles_from_parser(iter_records(parser_path))
+    parser_df = parser_roles_frame((item for item in items if item['span_scores']), CSV_COLUMNS + ['span_scores'])
+    span_scores = parser_df.span_scores.values
+    return intern_columns(parser_df.drop(columns=['span_scores'])), span_scores
+
+
+def curve_counts(sys_roles, sys_span_scores, grt_roles, min_scores: List[float]) -> np.ndarray:
+    # (n_min_scores, 9) counts in the order of COUNT_COLUMNS
+    all_metrics = evaluate_score_thresholds(sys_roles, sys_span_scores, grt_roles, min_scores)
+    return np.array([[count for metric in metrics for count in metric.as_tuple()] for metrics in all_metrics],
+                    dtype=np.int64).reshape(len(min_scores), len(COUNT_COLUMNS))
+
+
+def curve_predicate_chunk(keys: List[Tuple[str, int]]) -> np.ndarray:
+    sys_index, grt_index = POOL_STATE['sys_index'], POOL_STATE['grt_index']
+    span_scores, min_scores = POOL_STATE['span_scores'], POOL_STATE['min_scores']
+    total = np.zeros((len(min_scores), len(COUNT_COLUMNS)), dtype=np.int64)
+    for key in keys:
+        row_indices = sys_index.groups.get(key, [])
+        sys_roles = [sys_index.role_at(row_idx) for row_idx in row_indices]
+        sys_span_scores = [span_scores[row_idx] for row_idx in row_indices]
+        total += curve_counts(sys_roles, sys_span_scores, grt_index.roles(key), min_scores)
+    return total
+
+
+def score_curve(grt_index: PredicateIndex, sys_index: PredicateIndex, span_scores: np.ndarray,
+                min_scores: List[float], include_sys_only: bool = False, workers: int = 1,
+                chunk_size: int = EVAL_CHUNK_SIZE) -> pd.DataFrame:
+    keys = list(yield_paired_keys(sys_index, grt_index, include_sys_only))
+    pool_state = {'sys_index': sys_index, 'span_scores': span_scores, 'grt_index': grt_index,
+                  'min_scores': min_scores}
+    counts = sum_chunk_counts(curve_predicate_chunk, keys, pool_state, len(min_scores), workers, chunk_size)
+
+    curve = scores_frame(counts)
+    curve.insert(0, 'min_score', min_scores)
+    return curve
+
+
+def main(parser_path: str, reference_path: str, min_scores: List[float], include_sys_only: bool = False,
+         workers: int = 1, use_cache: bool = False, out_path: str = None):
+    min_scores = sorted(set(min_scores))
+    parser_df, span_scores = load_scored_parser(parser_path)
+    sys_index = PredicateIndex(parser_df)
+    del parser_df
+    grt_index = PredicateIndex(load_qasrl(reference_path, use_cache))
+    curve = score_curve(grt_index, sys_index, span_scores, min_scores, include_sys_only, workers)
+    with pd.option_context('display.max_columns', None, 'display.width', 250, 'display.precision', 4):
+        print(curve.to_string(index=False))
+    if out_path is not None:
+        curve.to_csv(out_path, index=False, encoding="utf-8")
+        print(out_path)
+    return curve
+
+
+if __name__ == "__main__":
+    ap = ArgumentParser()
+    ap.add_argument("parser_path", help="Parser output in JSON lines, as read by convert_parser_to_csv.py")
+    ap.add_argument("ground_truth_path")
+    ap.add_argument("--min_scores", type=float, nargs="+", default=DEFAULT_MIN_SCORES,
+                    help="Spans are kept when their score is above the threshold, as with "
+                         "convert_parser_to_csv.py --min_score")
+    ap.add_argument("--include_sys_only", action="store_true",
+                    help="Score predicates that appear only in the parser output instead of ignoring them")
+    ap.add_argument("--workers", type=int, default=1, help="Number of processes used to score predicates")
+    ap.add_argument("--cache", action="store_true",
+                    help="Load the decoded gold dataset from a binary cache next to its CSV, building it if needed")
+    ap.add_argument("--out", required=False, help="/path/to/score_curve.csv")
+    args = ap.parse_args()
+    main(args.parser_path, args.ground_truth_path, args.min_scores, args.include_sys_only, args.workers,
+         args.cache, args.out)
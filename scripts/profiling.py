@@ -0,0 +1,96 @@
+import json
+import time
+from collections import defaultdict
+from typing import Dict, Optional
+
+# Stage timers and counters for the evaluation pipeline.
+# PROFILER is disabled by default: stage() then returns a shared no-op context manager,
+# and hot paths only pay for an attribute check before counting (if PROFILER.enabled: ...).
+# Stage times are inclusive, a stage nested in another is also part of the outer one.
+# Times and counters of pool processes are added up, so their wall times are summed over processes.
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _Stage:
+    def __init__(self, profiler: 'Profiler', name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        stage = self.profiler.stages[self.name]
+        stage['wall'] += time.perf_counter() - self.wall_start
+        stage['cpu'] += time.process_time() - self.cpu_start
+        stage['calls'] += 1
+        return False
+
+
+NULL_STAGE = _NullStage()
+
+
+class Profiler:
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        self.stages: Dict[str, Dict[str, float]] = defaultdict(lambda: {'wall': 0.0, 'cpu': 0.0, 'calls': 0})
+        self.counters: Dict[str, int] = defaultdict(int)
+
+    def stage(self, name: str):
+        if not self.enabled:
+            return NULL_STAGE
+        return _Stage(self, name)
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] += n
+
+    def snapshot(self) -> Optional[dict]:
+        # Stages and counters collected so far, as plain dicts that can be sent between processes
+        if not self.enabled:
+            return None
+        return {'stages': {name: dict(stage) for name, stage in self.stages.items()},
+                'counters': dict(self.counters)}
+
+    def pop_snapshot(self) -> Optional[dict]:
+        snapshot = self.snapshot()
+        self.reset()
+        return snapshot
+
+    def merge(self, snapshot: Optional[dict]):
+        if snapshot is None:
+            return
+        for name, stage in snapshot['stages'].items():
+            for field, value in stage.items():
+                self.stages[name][field] += value
+        for name, value in snapshot['counters'].items():
+            self.counters[name] += value
+
+    def summary(self) -> dict:
+        return {'stages': {name: dict(stage) for name, stage in self.stages.items()},
+                'counters': dict(sorted(self.counters.items()))}
+
+    def write_json(self, path: str):
+        with open(path, "w", encoding="utf-8") as fout:
+            json.dump(self.summary(), fout, indent=2)
+
+    def report(self) -> str:
+        lines = ["Stage\tWall (s)\tCPU (s)\tCalls"]
+        for name, stage in self.stages.items():
+            lines.append(f"{name}\t{stage['wall']:.3f}\t{stage['cpu']:.3f}\t{stage['calls']}")
+        lines.extend(f"{name}: {value}" for name, value in sorted(self.counters.items()))
+        return "\n".join(lines)
+
+
+PROFILER = Profiler()
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import pickle
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from common import Role, QUESTION_FIELDS
+from evaluate import MATCH_IOU_THRESHOLD, MATCHING_BACKEND
+
+# Per-predicate evaluation results, stored in a SQLite file and keyed by a hash of everything
+# that determines them: the system and gold roles of the predicate and the matcher settings.
+# Alignment rows also depend on the sentence tokens, so their key adds the tokens.
+# Entries are evicted least recently used first once the file grows past max_bytes.
+RESULT_CACHE_VERSION = 3
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+COUNTS = "counts"
+ALIGNMENT = "alignment"
+# SQLite limits the number of parameters in a single statement
+LOOKUP_BATCH_SIZE = 500
+
+
+def roles_digest(roles: Sequence[Role]) -> str:
+    # Role order is kept since it can break ties in the argument matching.
+    # Paraphrase ids are left out: they depend on the order questions were loaded in,
+    # and the fields they are derived from are already part of the digest.
+    return repr([(role.question.text,
+                  tuple(getattr(role.question, field) for field in QUESTION_FIELDS),
+                  role.arguments) for role in roles])
+
+
+def predicate_hash(sys_roles: Sequence[Role], grt_roles: Sequence[Role], matching_backend: str = None) -> str:
+    config = (RESULT_CACHE_VERSION, matching_backend or MATCHING_BACKEND, MATCH_IOU_THRESHOLD)
+    sha = hashlib.sha1()
+    sha.update(repr(config).encode("utf-8"))
+    sha.update(roles_digest(sys_roles).encode("utf-8"))
+    sha.update(b"\0")
+    sha.update(roles_digest(grt_roles).encode("utf-8"))
+    return sha.hexdigest()
+
+
+def alignment_hash(content_hash: str, tokens: List[str]) -> str:
+    sha = hashlib.sha1(content_hash.encode("utf-8"))
+    sha.update(" ".join(tokens).encode("utf-8"))
+    return sha.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, db_path: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.hits = {COUNTS: 0, ALIGNMENT: 0}
+        self.misses = {COUNTS: 0, ALIGNMENT: 0}
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS results ("
+                          "key TEXT PRIMARY KEY, kind TEXT NOT NULL, value BLOB NOT NULL, "
+                          "n_bytes INTEGER NOT NULL, last_used REAL NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self.conn.commit()
+
+    def get_many(self, kind: str, keys: Sequence[str]) -> Dict[str, object]:
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        for start in range(0, len(unique_keys), LOOKUP_BATCH_SIZE):
+            batch = unique_keys[start: start + LOOKUP_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.conn.execute(f"SELECT key, value FROM results WHERE kind = ? AND key IN ({placeholders})",
+                                     [kind] + batch)
+            for key, value in rows:
+                found[key] = self.decode(kind, value)
+        self.touch(found.keys())
+        self.hits[kind] += sum(1 for key in keys if key in found)
+        self.misses[kind] += sum(1 for key in keys if key not in found)
+        return found
+
+    def get(self, kind: str, key: str) -> Optional[object]:
+        return self.get_many(kind, [key]).get(key)
+
+    def put_many(self, kind: str, items: Iterable[Tuple[str, object]]):
+        now = time.time()
+        rows = []
+        for key, value in items:
+            blob = self.encode(kind, value)
+            rows.append((key, kind, blob, len(blob), now))
+        self.conn.executemany("INSERT OR REPLACE INTO results (key, kind, value, n_bytes, last_used) "
+                              "VALUES (?, ?, ?, ?, ?)", rows)
+        self.conn.commit()
+
+    def put(self, kind: str, key: str, value: object):
+        self.put_many(kind, [(key, value)])
+
+    def touch(self, keys: Iterable[str]):
+        now = time.time()
+        self.conn.executemany("UPDATE results SET last_used = ? WHERE key = ?", [(now, key) for key in keys])
+        self.conn.commit()
+
+    @staticmethod
+    def encode(kind: str, value: object) -> bytes:
+        if kind == COUNTS:
+            return json.dumps(list(value)).encode("utf-8")
+        # Alignment rows hold tuples and NaNs that have to come back exactly as they were written
+        return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def decode(kind: str, blob: bytes) -> object:
+        if kind == COUNTS:
+            return tuple(json.loads(blob.decode("utf-8")))
+        return pickle.loads(blob)
+
+    def total_bytes(self) -> int:
+        return self.conn.execute("SELECT COALESCE(SUM(n_bytes), 0) FROM results").fetchone()[0]
+
+    def evict(self) -> int:
+        excess = self.total_bytes() - self.max_bytes
+        if excess <= 0:
+            return 0
+        evicted = []
+        for key, n_bytes in self.conn.execute("SELECT key, n_bytes FROM results ORDER BY last_used"):
+            if excess <= 0:
+                break
+            evicted.append((key,))
+            excess -= n_bytes
+        self.conn.executemany("DELETE FROM results WHERE key = ?", evicted)
+        self.conn.commit()
+        self.conn.execute("VACUUM")
+        return len(evicted)
+
+    def hit_rate(self, kind: str) -> float:
+        n_lookups = self.hits[kind] + self.misses[kind]
+        return self.hits[kind] / n_lookups if n_lookups else float("nan")
+
+    def report(self) -> str:
+        lines = []
+        for kind in (COUNTS, ALIGNMENT):
+            n_lookups = self.hits[kind] + self.misses[kind]
+            if n_lookups:
+                lines.append(f"Result cache {kind}: {self.hits[kind]}/{n_lookups} hits "
+                             f"({self.hit_rate(kind) * 100:5.2f}%)")
+        return "\n".join(lines)
+
+    def close(self):
+        self.evict()
+        self.conn.close()
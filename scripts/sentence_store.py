@@ -0,0 +1,173 @@
+import json
+import os
+import shutil
+from argparse import ArgumentParser
+from typing import Dict, Iterable, List, Union
+
+import numpy as np
+import pandas as pd
+
+from common import Argument
+from dataset_cache import file_hash
+from decode_encode_answers import NO_RANGE
+
+# Sentences of a corpus as a directory of flat .npy arrays, opened memory mapped:
+#   text: uint8, the UTF-8 space joined tokens of all sentences, one after the other
+#   sentence_bytes: int64 byte offset of every sentence in text (n_sentences + 1)
+#   sentence_tokens: int64 offset of every sentence in token_offsets (n_sentences + 1)
+#   token_offsets: int32 byte offset of every token in its sentence, followed by the sentence length + 1,
+#       so the text of tokens [start, end) is text[token_offsets[start]: token_offsets[end] - 1]
+#   ids: the UTF-8 qasrl_ids in sorted order, and id_rows the sentence of each one
+# A store built from a CSV is rebuilt whenever the hash of the CSV or the store version changes.
+STORE_VERSION = 1
+STORE_SUFFIX = ".sent_store"
+META_FILE = "meta.json"
+STORE_ARRAYS = ['text', 'sentence_bytes', 'sentence_tokens', 'token_offsets', 'ids', 'id_rows']
+
+
+class SentenceStore:
+    # Read only mapping from qasrl_id to tokens, whose sentences render the text of their spans from the store.
+    # Pool processes reopen the arrays from the store path instead of receiving a copy of them.
+    def __init__(self, store_path: str):
+        self.store_path = store_path
+        for name in STORE_ARRAYS:
+            setattr(self, name, np.load(os.path.join(store_path, f"{name}.npy"), mmap_mode="r"))
+
+    def __getstate__(self):
+        return {'store_path': self.store_path}
+
+    def __setstate__(self, state):
+        self.__init__(state['store_path'])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, qasrl_id):
+        return self.find_row(qasrl_id) >= 0
+
+    def __getitem__(self, qasrl_id) -> List[str]:
+        row = self.row(qasrl_id)
+        n_tokens = self.sentence_tokens[row + 1] - self.sentence_tokens[row] - 1
+        if not n_tokens:
+            return []
+        return self.text[self.sentence_bytes[row]: self.sentence_bytes[row + 1]].tobytes().decode("utf-8").split(" ")
+
+    def find_row(self, qasrl_id) -> int:
+        # Sentence of the id, -1 for an unknown id
+        key = str(qasrl_id).encode("utf-8")
+        # Longer ids than the longest stored one would be truncated to its width
+        if not len(self.ids) or len(key) > self.ids.itemsize:
+            return -1
+        position = min(int(np.searchsorted(self.ids, np.array(key, dtype=self.ids.dtype))), len(self.ids) - 1)
+        return int(self.id_rows[position]) if self.ids[position] == key else -1
+
+    def row(self, qasrl_id) -> int:
+        row = self.find_row(qasrl_id)
+        if row < 0:
+            raise KeyError(qasrl_id)
+        return row
+
+    def sentence(self, qasrl_id) -> 'StoredSentence':
+        return StoredSentence(self, self.row(qasrl_id))
+
+
+class StoredSentence:
+    # Same span_texts as SentenceText, over the bytes and token offsets of one sentence of a SentenceStore.
+    def __init__(self, store: SentenceStore, row: int):
+        self.data = store.text[store.sentence_bytes[row]: store.sentence_bytes[row + 1]].tobytes()
+        self.offsets = store.token_offsets[store.sentence_tokens[row]: store.sentence_tokens[row + 1]].tolist()
+        self.n_tokens = len(self.offsets) - 1
+
+    def span_texts(self, args: Iterable[Argument]) -> List[str]:
+        texts = []
+        for arg in args:
+            if arg == NO_RANGE:
+                texts.append(NO_RANGE)
+                continue
+            start, end, _ = slice(arg[0], arg[1]).indices(self.n_tokens)
+            texts.append(self.data[self.offsets[start]: self.offsets[end] - 1].decode("utf-8") if start < end else "")
+        return texts
+
+
+def get_store_path(sents_path: str) -> str:
+    return os.path.splitext(sents_path)[0] + STORE_SUFFIX
+
+
+def is_store_valid(store_path: str, source_hash: str) -> bool:
+    meta_path = os.path.join(store_path, META_FILE)
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, "r", encoding="utf-8") as fin:
+        meta = json.load(fin)
+    return meta.get('version') == STORE_VERSION and meta.get('source_hash') == source_hash
+
+
+def write_store(sents_df: pd.DataFrame, store_path: str, source_hash: str = None):
+    # A qasrl_id that appears more than once keeps its last sentence, as in a dict built from the rows
+    sents_df = sents_df.drop_duplicates('qasrl_id', keep='last')
+    ids = [str(qasrl_id).encode("utf-8") for qasrl_id in sents_df.qasrl_id]
+    sentence_bytes = np.zeros(len(ids) + 1, dtype=np.int64)
+    sentence_tokens = np.zeros(len(ids) + 1, dtype=np.int64)
+    chunks, token_offsets = [], []
+    for row, tokens in enumerate(sents_df.tokens.apply(str.split)):
+        encoded = [token.encode("utf-8") for token in tokens]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(token) + 1 for token in encoded], out=offsets[1:])
+        chunks.append(b" ".join(encoded))
+        token_offsets.append(offsets)
+        sentence_bytes[row + 1] = sentence_bytes[row] + len(chunks[-1])
+        sentence_tokens[row + 1] = sentence_tokens[row] + len(offsets)
+    token_offsets = np.concatenate(token_offsets) if token_offsets else np.zeros(0, dtype=np.int64)
+    order = np.argsort(np.array(ids, dtype=bytes), kind="stable") if ids else np.zeros(0, dtype=np.int64)
+    arrays = {'text': np.frombuffer(b"".join(chunks), dtype=np.uint8),
+              'sentence_bytes': sentence_bytes,
+              'sentence_tokens': sentence_tokens,
+              'token_offsets': token_offsets.astype(np.int32),
+              'ids': np.array(ids, dtype=bytes)[order] if ids else np.zeros(0, dtype="S1"),
+              'id_rows': order.astype(np.int64)}
+
+    tmp_path = f"{store_path}.tmp{os.getpid()}"
+    os.makedirs(tmp_path, exist_ok=True)
+    for name, values in arrays.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), values)
+    meta = {'version': STORE_VERSION, 'source_hash': source_hash,
+            'n_sentences': len(ids), 'n_tokens': int(len(token_offsets) - len(ids))}
+    with open(os.path.join(tmp_path, META_FILE), "w", encoding="utf-8") as fout:
+        json.dump(meta, fout)
+    if os.path.exists(store_path):
+        shutil.rmtree(store_path)
+    os.replace(tmp_path, store_path)
+
+
+def build_store(sents_path: str, store_path: str = None) -> str:
+    store_path = store_path or get_store_path(sents_path)
+    write_store(pd.read_csv(sents_path), store_path, file_hash(sents_path))
+    return store_path
+
+
+def load_sentences(sents_path: str, use_store: bool = False) -> Union[SentenceStore, Dict[str, List[str]]]:
+    # A prebuilt store directory is opened as is. With use_store, a CSV is read through a store
+    # next to it, built if needed. Otherwise the tokens of every sentence are held in a dict.
+    if os.path.isdir(sents_path):
+        return SentenceStore(sents_path)
+    if not use_store:
+        sents = pd.read_csv(sents_path)
+        return dict(zip(sents.qasrl_id, sents.tokens.apply(str.split)))
+
+    store_path = get_store_path(sents_path)
+    if not is_store_valid(store_path, file_hash(sents_path)):
+        try:
+            build_store(sents_path, store_path)
+        except OSError as e:
+            print(f"Could not build a sentence store for {sents_path}: {e}")
+            return load_sentences(sents_path, use_store=False)
+    return SentenceStore(store_path)
+
+
+if __name__ == "__main__":
+    ap = ArgumentParser()
+    ap.add_argument("sents_path", help="/path/to/sentences.csv with qasrl_id and tokens columns")
+    ap.add_argument("--out", required=False, help=f"Store directory, next to the CSV with a {STORE_SUFFIX} "
+                                                  f"suffix by default")
+    args = ap.parse_args()
+    print(build_store(args.sents_path, args.out))
@@ -0,0 +1,150 @@
+from argparse import ArgumentParser
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from evaluate_dataset import COUNT_COLUMNS
+
+# Works on the per-predicate count tables written by evaluate_dataset.py --predicate_counts.
+# Predicates are the resampling unit: a resample is an index array of predicate rows,
+# turned into per-row weights and reduced with a single matrix product per batch.
+KEY_COLUMNS = ['qasrl_id', 'verb_idx']
+METRIC_NAMES = ['Unlabelled Argument', 'labelled Argument', 'Unlabelled Role']
+DEFAULT_RESAMPLES = 10000
+# A batch of resamples holds a few (batch_size, n_predicates) int64 arrays at a time, the batch size is
+# derived from the number of predicates so that each of these arrays stays within this many cells (32 MB).
+MAX_BATCH_CELLS = 1 << 22
+
+
+def load_count_table(path: str) -> pd.DataFrame:
+    table = pd.read_csv(path)
+    table[COUNT_COLUMNS] = table[COUNT_COLUMNS].astype(np.int32)
+    return table
+
+
+def prf_from_counts(counts: np.ndarray) -> np.ndarray:
+    # counts: (..., 9) summed TP, FP, FN for the three metrics -> (..., 3, 3) of P, R, F1 per metric
+    counts = counts.reshape(counts.shape[:-1] + (3, 3)).astype(np.float64)
+    tp, fp, fn = counts[..., 0], counts[..., 1], counts[..., 2]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        prec = tp / (tp + fp)
+        recall = tp / (tp + fn)
+        f1 = 2 * tp / (2 * tp + fp + fn)
+    return np.stack([prec, recall, f1], axis=-1)
+
+
+def resample_weights(rng: np.random.Generator, n_rows: int, n_resamples: int) -> np.ndarray:
+    # How many times each predicate was drawn in each resample
+    indices = rng.integers(0, n_rows, size=(n_resamples, n_rows))
+    indices += np.arange(n_resamples)[:, np.newaxis] * n_rows
+    weights = np.bincount(indices.ravel(), minlength=n_resamples * n_rows)
+    return weights.reshape(n_resamples, n_rows)
+
+
+def resample_batch_size(n_rows: int, n_resamples: int, batch_size: int = None) -> int:
+    if batch_size is None:
+        batch_size = MAX_BATCH_CELLS // max(n_rows, 1)
+    return max(1, min(batch_size, n_resamples))
+
+
+def bootstrap_counts(counts: np.ndarray, n_resamples: int, seed: int = None,
+                     batch_size: int = None) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    counts = counts.astype(np.int64)
+    batch_size = resample_batch_size(len(counts), n_resamples, batch_size)
+    totals = []
+    for start in range(0, n_resamples, batch_size):
+        n_batch = min(batch_size, n_resamples - start)
+        totals.append(resample_weights(rng, len(counts), n_batch) @ counts)
+    return np.concatenate(totals)
+
+
+def bootstrap_ci(table: pd.DataFrame, n_resamples: int = DEFAULT_RESAMPLES, alpha: float = 0.05,
+                 seed: int = None, batch_size: int = None) -> pd.DataFrame:
+    counts = table[COUNT_COLUMNS].values
+    observed = prf_from_counts(counts.sum(axis=0))
+    resampled = prf_from_counts(bootstrap_counts(counts, n_resamples, seed, batch_size))
+    lower = np.nanpercentile(resampled, 100 * alpha / 2, axis=0)
+    upper = np.nanpercentile(resampled, 100 * (1 - alpha / 2), axis=0)
+
+    rows = []
+    for metric_idx, metric_name in enumerate(METRIC_NAMES):
+        for score_idx, score_name in enumerate(['prec', 'recall', 'f1']):
+            rows.append({'metric': metric_name, 'score': score_name,
+                         'value': observed[metric_idx, score_idx],
+                         'ci_low': lower[metric_idx, score_idx],
+                         'ci_high': upper[metric_idx, score_idx]})
+    return pd.DataFrame(rows, columns=['metric', 'score', 'value', 'ci_low', 'ci_high'])
+
+
+def pair_count_tables(table_a: pd.DataFrame, table_b: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    # A predicate evaluated for only one of the systems (e.g. a system-only predicate)
+    # contributes nothing to the other one, which keeps both totals unchanged.
+    paired = pd.merge(table_a[KEY_COLUMNS + COUNT_COLUMNS], table_b[KEY_COLUMNS + COUNT_COLUMNS],
+                      on=KEY_COLUMNS, how="outer", suffixes=("_a", "_b"), sort=True)
+    paired = paired.fillna(0)
+    counts_a = paired[[f"{col}_a" for col in COUNT_COLUMNS]].values.astype(np.int64)
+    counts_b = paired[[f"{col}_b" for col in COUNT_COLUMNS]].values.astype(np.int64)
+    return counts_a, counts_b
+
+
+def paired_permutation_test(table_a: pd.DataFrame, table_b: pd.DataFrame,
+                            n_resamples: int = DEFAULT_RESAMPLES, seed: int = None,
+                            batch_size: int = None) -> pd.DataFrame:
+    # Randomly swaps the outputs of the two systems on each predicate, and compares the
+    # observed difference in scores to the differences under the swaps.
+    counts_a, counts_b = pair_count_tables(table_a, table_b)
+    total_a, total_b = counts_a.sum(axis=0), counts_b.sum(axis=0)
+    observed = prf_from_counts(total_a) - prf_from_counts(total_b)
+    delta = counts_b - counts_a
+
+    rng = np.random.default_rng(seed)
+    batch_size = resample_batch_size(len(delta), n_resamples, batch_size)
+    n_extreme = np.zeros(observed.shape, dtype=np.int64)
+    for start in range(0, n_resamples, batch_size):
+        n_batch = min(batch_size, n_resamples - start)
+        swaps = rng.integers(0, 2, size=(n_batch, len(delta)), dtype=np.int8)
+        swapped_delta = swaps @ delta
+        diffs = prf_from_counts(total_a + swapped_delta) - prf_from_counts(total_b - swapped_delta)
+        n_extreme += (np.abs(diffs) >= np.abs(observed) - 1e-12).sum(axis=0)
+    p_values = (n_extreme + 1) / (n_resamples + 1)
+
+    scores_a, scores_b = prf_from_counts(total_a), prf_from_counts(total_b)
+    rows = []
+    for metric_idx, metric_name in enumerate(METRIC_NAMES):
+        for score_idx, score_name in enumerate(['prec', 'recall', 'f1']):
+            rows.append({'metric': metric_name, 'score': score_name,
+                         'system_a': scores_a[metric_idx, score_idx],
+                         'system_b': scores_b[metric_idx, score_idx],
+                         'diff': observed[metric_idx, score_idx],
+                         'p_value': p_values[metric_idx, score_idx]})
+    return pd.DataFrame(rows, columns=['metric', 'score', 'system_a', 'system_b', 'diff', 'p_value'])
+
+
+def main(counts_path: str, other_counts_path: str = None, n_resamples: int = DEFAULT_RESAMPLES,
+         alpha: float = 0.05, seed: int = None, batch_size: int = None):
+    table = load_count_table(counts_path)
+    print(f"Bootstrap CI over {len(table)} predicates ({n_resamples} resamples, alpha={alpha})")
+    print(bootstrap_ci(table, n_resamples, alpha, seed, batch_size).to_string(index=False))
+    if other_counts_path is None:
+        return
+
+    other_table = load_count_table(other_counts_path)
+    print()
+    print(f"Paired permutation test ({n_resamples} resamples)")
+    print(paired_permutation_test(table, other_table, n_resamples, seed, batch_size).to_string(index=False))
+
+
+if __name__ == "__main__":
+    ap = ArgumentParser()
+    ap.add_argument("counts_path", help="/path/to/system_a.predicate_counts.csv")
+    ap.add_argument("other_counts_path", nargs="?",
+                    help="/path/to/system_b.predicate_counts.csv, compared to the first system")
+    ap.add_argument("--resamples", type=int, default=DEFAULT_RESAMPLES)
+    ap.add_argument("--alpha", type=float, default=0.05)
+    ap.add_argument("--seed", type=int, required=False)
+    ap.add_argument("--batch_size", type=int, required=False,
+                    help="Resamples drawn at once, by default as many as fit in MAX_BATCH_CELLS")
+    args = ap.parse_args()
+    main(args.counts_path, args.other_counts_path, args.resamples, args.alpha, args.seed, args.batch_size)
@@ -0,0 +1,216 @@
+import os
+from argparse import ArgumentParser
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from decode_encode_answers import SPAN_SEPARATOR, encode_span_arrays
+
+# Seeded generator of gold and system QASRL annotations in the column schema of data/gold,
+# with a matching sentences file. Slot values follow their frequencies in wikinews.dev.gold.
+# Sizes scale linearly with n_predicates, ~340K predicates with the default settings is 1M gold rows.
+GOLD_COLUMNS = ['qasrl_id', 'verb_idx', 'verb', 'worker_id', 'assign_id', 'source_assign_id', 'question',
+                'is_redundant', 'answer_range', 'answer', 'wh', 'subj', 'obj', 'obj2', 'aux', 'prep',
+                'verb_prefix', 'is_passive', 'is_negated', 'verb_slot_inflection']
+WH_VALUES = (['what', 'who', 'when', 'where', 'how', 'why', 'how much', 'how long'],
+             [0.34, 0.28, 0.11, 0.10, 0.08, 0.07, 0.01, 0.01])
+SUBJ_VALUES = (['', 'someone', 'something'], [0.38, 0.42, 0.20])
+OBJ_VALUES = (['', 'something', 'someone'], [0.65, 0.31, 0.04])
+OBJ2_VALUES = (['', 'something', 'somewhere', 'someone', 'do'], [0.79, 0.12, 0.05, 0.025, 0.015])
+AUX_VALUES = (['did', 'was', '', 'is', 'might', 'does', 'will', 'has'],
+              [0.26, 0.22, 0.17, 0.11, 0.07, 0.05, 0.06, 0.06])
+PREP_VALUES = (['', 'to', 'for', 'with', 'from', 'as', 'in'], [0.76, 0.07, 0.04, 0.04, 0.03, 0.03, 0.03])
+INFLECTION_VALUES = (['Stem', 'Past', 'PresentParticiple', 'PresentSingular3rd', 'PastParticiple'],
+                     [0.42, 0.38, 0.15, 0.03, 0.02])
+VERBS = ['said', 'announced', 'reported', 'killed', 'won', 'found', 'released', 'suspended',
+         'posted', 'ordered', 'included', 'helped', 'moved', 'arrested', 'rejected', 'followed']
+PREDICATES_PER_SENTENCE = 3
+MIN_SENTENCE_LENGTH = 15
+MAX_SENTENCE_LENGTH = 45
+
+
+def generate_workload(n_predicates: int, roles_per_predicate: float = 2.9, spans_per_role: float = 1.15,
+                      noise: float = 0.2, overlap: float = 0.1,
+                      seed: int = 0) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    # Returns gold, system and sentence frames, with answers and ranges encoded as in the CSV files
+    rng = np.random.default_rng(seed)
+    sents_df, sent_lengths = generate_sentences(rng, -(-n_predicates // PREDICATES_PER_SENTENCE))
+
+    pred_sents = np.arange(n_predicates) // PREDICATES_PER_SENTENCE
+    pred_lengths = sent_lengths[pred_sents]
+    # Every predicate of a sentence gets its own third of the sentence for its verb index
+    section = pred_lengths // PREDICATES_PER_SENTENCE
+    verb_idx = (np.arange(n_predicates) % PREDICATES_PER_SENTENCE) * section + rng.integers(0, section)
+    n_roles = 1 + rng.poisson(max(roles_per_predicate - 1, 0), size=n_predicates)
+    gold = generate_roles(rng, np.repeat(np.arange(n_predicates), n_roles), pred_lengths, spans_per_role, overlap)
+    sys = add_noise(rng, gold, pred_lengths, noise, spans_per_role)
+
+    sent_tokens = sents_df.tokens.str.split().tolist()
+    pred_ids = sents_df.qasrl_id.values[pred_sents]
+    pred_verbs = np.array(VERBS)[rng.integers(0, len(VERBS), size=n_predicates)]
+    gold_df = to_frame(gold, pred_ids, verb_idx, pred_verbs, pred_sents, sent_tokens, worker_id="GOLD")
+    sys_df = to_frame(sys, pred_ids, verb_idx, pred_verbs, pred_sents, sent_tokens, worker_id="SYSTEM")
+    return gold_df, sys_df, sents_df
+
+
+def generate_sentences(rng: np.random.Generator, n_sents: int) -> Tuple[pd.DataFrame, np.ndarray]:
+    lengths = rng.integers(MIN_SENTENCE_LENGTH, MAX_SENTENCE_LENGTH + 1, size=n_sents)
+    words = rng.integers(0, 5000, size=int(lengths.sum()))
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    word_strs = [f"w{word}" for word in words.tolist()]
+    tokens = [" ".join(word_strs[start: end]) for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+    qasrl_ids = [f"Synthetic:{sent_idx // 10}:{sent_idx % 10}" for sent_idx in range(n_sents)]
+    sents_df = pd.DataFrame({'qasrl_id': qasrl_ids, 'tokens': tokens, 'sentence': tokens})
+    return sents_df, lengths
+
+
+def sample(rng: np.random.Generator, values_and_probs, size: int) -> np.ndarray:
+    values, probs = values_and_probs
+    probs = np.array(probs) / np.sum(probs)
+    return np.array(values, dtype=object)[rng.choice(len(values), size=size, p=probs)]
+
+
+def generate_roles(rng: np.random.Generator, role_preds: np.ndarray, pred_lengths: np.ndarray,
+                   spans_per_role: float, overlap: float) -> dict:
+    # Roles as flat arrays, with the spans of role i at span_offsets[i]:span_offsets[i+1]
+    n_roles = len(role_preds)
+    slots = {'wh': sample(rng, WH_VALUES, n_roles),
+             'subj': sample(rng, SUBJ_VALUES, n_roles),
+             'obj': sample(rng, OBJ_VALUES, n_roles),
+             'obj2': sample(rng, OBJ2_VALUES, n_roles),
+             'aux': sample(rng, AUX_VALUES, n_roles),
+             'prep': sample(rng, PREP_VALUES, n_roles),
+             'verb_slot_inflection': sample(rng, INFLECTION_VALUES, n_roles),
+             'is_passive': rng.random(n_roles) < 0.24,
+             'is_negated': rng.random(n_roles) < 0.05}
+    n_spans = 1 + rng.poisson(max(spans_per_role - 1, 0), size=n_roles)
+    span_preds = np.repeat(role_preds, n_spans)
+    starts, ends = random_spans(rng, pred_lengths[span_preds])
+
+    # With probability overlap a span is moved onto the previous span of the same predicate
+    is_overlapping = (rng.random(len(starts)) < overlap)
+    is_overlapping[1:] &= span_preds[1:] == span_preds[:-1]
+    is_overlapping[0] = False
+    prev_idx = np.flatnonzero(is_overlapping) - 1
+    shift = rng.integers(-1, 2, size=len(prev_idx))
+    lengths = pred_lengths[span_preds[prev_idx]]
+    starts[is_overlapping] = np.clip(starts[prev_idx] + shift, 0, lengths - 1)
+    ends[is_overlapping] = np.clip(ends[prev_idx] + shift, starts[is_overlapping] + 1, lengths)
+    return {'preds': role_preds, 'slots': slots, 'starts': starts, 'ends': ends,
+            'span_offsets': np.concatenate([[0], np.cumsum(n_spans)])}
+
+
+def random_spans(rng: np.random.Generator, lengths: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    starts = (rng.random(len(lengths)) * lengths).astype(np.int64)
+    span_lengths = rng.geometric(0.35, size=len(lengths))
+    ends = np.minimum(starts + span_lengths, lengths)
+    return starts, ends
+
+
+def add_noise(rng: np.random.Generator, gold: dict, pred_lengths: np.ndarray,
+              noise: float, spans_per_role: float) -> dict:
+    # Jitters span boundaries, drops spans, relabels questions and adds spurious roles
+    n_spans = np.diff(gold['span_offsets'])
+    span_roles = np.repeat(np.arange(len(gold['preds'])), n_spans)
+    lengths = pred_lengths[gold['preds'][span_roles]]
+    starts, ends = gold['starts'].copy(), gold['ends'].copy()
+    is_jittered = rng.random(len(starts)) < noise
+    starts[is_jittered] = np.clip(starts[is_jittered] + rng.integers(-2, 3, size=is_jittered.sum()),
+                                  0, lengths[is_jittered] - 1)
+    ends[is_jittered] = np.clip(ends[is_jittered] + rng.integers(-2, 3, size=is_jittered.sum()),
+                                starts[is_jittered] + 1, lengths[is_jittered])
+    is_kept = rng.random(len(starts)) >= noise / 2
+
+    slots = {field: values.copy() for field, values in gold['slots'].items()}
+    is_relabelled = rng.random(len(gold['preds'])) < noise / 2
+    slots['wh'][is_relabelled] = sample(rng, WH_VALUES, int(is_relabelled.sum()))
+
+    n_kept = np.bincount(span_roles[is_kept], minlength=len(gold['preds']))
+    kept_roles = np.flatnonzero(n_kept > 0)
+    spurious = generate_roles(rng, np.sort(rng.choice(len(pred_lengths),
+                                                      size=int(noise * len(gold['preds']) / 2))),
+                              pred_lengths, spans_per_role, overlap=0.0)
+
+    # Spurious roles are placed after the roles of the same predicate, and their spans move with them
+    role_preds = np.concatenate([gold['preds'][kept_roles], spurious['preds']])
+    order = np.argsort(role_preds, kind="stable")
+    all_starts = np.concatenate([starts[is_kept], spurious['starts']])
+    all_ends = np.concatenate([ends[is_kept], spurious['ends']])
+    all_n_spans = np.concatenate([n_kept[kept_roles], np.diff(spurious['span_offsets'])])
+    span_offsets = np.concatenate([[0], np.cumsum(all_n_spans)])
+    ordered_n_spans = all_n_spans[order]
+    ordered_offsets = np.concatenate([[0], np.cumsum(ordered_n_spans)])
+    span_order = (np.repeat(span_offsets[:-1][order] - ordered_offsets[:-1], ordered_n_spans)
+                  + np.arange(ordered_offsets[-1]))
+    all_slots = {field: np.concatenate([values[kept_roles], spurious['slots'][field]])[order]
+                 for field, values in slots.items()}
+    return {'preds': role_preds[order], 'slots': all_slots,
+            'starts': all_starts[span_order], 'ends': all_ends[span_order],
+            'span_offsets': ordered_offsets}
+
+
+def question_texts(slots: dict, verbs: np.ndarray) -> list:
+    fields = zip(slots['wh'].tolist(), slots['aux'].tolist(), slots['subj'].tolist(), verbs.tolist(),
+                 slots['obj'].tolist(), slots['prep'].tolist(), slots['obj2'].tolist())
+    return [" ".join(word for word in (wh.capitalize(), aux, subj, verb, obj, prep, obj2) if word) + "?"
+            for wh, aux, subj, verb, obj, prep, obj2 in fields]
+
+
+def to_frame(roles: dict, pred_ids: np.ndarray, verb_idx: np.ndarray, pred_verbs: np.ndarray,
+             pred_sents: np.ndarray, sent_tokens: list, worker_id: str) -> pd.DataFrame:
+    preds = roles['preds']
+    offsets = roles['span_offsets']
+    is_no_range = np.zeros(len(preds), dtype=bool)
+    answer_range = encode_span_arrays(roles['starts'], roles['ends'], offsets, is_no_range)
+    span_sents = np.repeat(pred_sents[preds], np.diff(offsets))
+    span_texts = [" ".join(sent_tokens[sent][start: end]) for sent, start, end
+                  in zip(span_sents.tolist(), roles['starts'].tolist(), roles['ends'].tolist())]
+    answers = [SPAN_SEPARATOR.join(span_texts[start: end])
+               for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+    qasrl_df = pd.DataFrame({
+        'qasrl_id': pred_ids[preds],
+        'verb_idx': verb_idx[preds],
+        'verb': pred_verbs[preds],
+        'worker_id': worker_id,
+        'assign_id': [f"{worker_id}{pred}" for pred in preds.tolist()],
+        'source_assign_id': "",
+        'question': question_texts(roles['slots'], pred_verbs[preds]),
+        'is_redundant': False,
+        'answer_range': answer_range,
+        'answer': answers,
+        'verb_prefix': ""})
+    for field, values in roles['slots'].items():
+        qasrl_df[field] = values
+    return qasrl_df[GOLD_COLUMNS]
+
+
+def write_workload(out_dir: str, gold_df: pd.DataFrame, sys_df: pd.DataFrame,
+                   sents_df: pd.DataFrame, name: str = "synthetic") -> Tuple[str, str, str]:
+    os.makedirs(out_dir, exist_ok=True)
+    gold_path = os.path.join(out_dir, f"{name}.gold.csv")
+    sys_path = os.path.join(out_dir, f"{name}.sys.csv")
+    sents_path = os.path.join(out_dir, f"{name}.sentences.csv")
+    gold_df.to_csv(gold_path, index=False, encoding="utf-8")
+    sys_df.to_csv(sys_path, index=False, encoding="utf-8")
+    sents_df.to_csv(sents_path, index=False, encoding="utf-8")
+    return gold_path, sys_path, sents_path
+
+
+if __name__ == "__main__":
+    ap = ArgumentParser()
+    ap.add_argument("out_dir", help="/path/to/directory for the gold, system and sentence CSVs")
+    ap.add_argument("--predicates", type=int, default=1264, help="Number of gold predicates")
+    ap.add_argument("--roles", type=float, default=2.9, help="Mean number of roles per predicate")
+    ap.add_argument("--spans", type=float, default=1.15, help="Mean number of answer spans per role")
+    ap.add_argument("--noise", type=float, default=0.2,
+                    help="Rate of jittered, dropped and relabelled system answers")
+    ap.add_argument("--overlap", type=float, default=0.1,
+                    help="Rate of spans that overlap the previous span of their predicate")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--name", default="synthetic")
+    args = ap.parse_args()
+    dfs = generate_workload(args.predicates, args.roles, args.spans, args.noise, args.overlap, args.seed)
+    for path in write_workload(args.out_dir, *dfs, name=args.name):
+        print(path)
@@ -0,0 +1,76 @@
+from argparse import ArgumentParser
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from dataset_cache import load_qasrl
+from evaluate import evaluate_thresholds, MATCH_IOU_THRESHOLD
+from evaluate_dataset import PredicateIndex, COUNT_COLUMNS, EVAL_CHUNK_SIZE, POOL_STATE, as_predicate_index, \
+    sum_chunk_counts, yield_paired_keys
+from evaluate_systems import scores_frame
+
+# Metrics of the assignment matcher for a list of IoU thresholds, from a single pass over the predicates.
+# The IoU matrices of every predicate are computed once, and only the matching, the consolidation
+# of unmatched system arguments and the scoring are repeated for each threshold.
+DEFAULT_THRESHOLDS = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
+
+
+def sweep_counts(sys_roles, grt_roles, thresholds: List[float]) -> np.ndarray:
+    # (n_thresholds, 9) counts in the order of COUNT_COLUMNS
+    all_metrics = evaluate_thresholds(sys_roles, grt_roles, thresholds)
+    return np.array([[count for metric in metrics for count in metric.as_tuple()] for metrics in all_metrics],
+                    dtype=np.int64).reshape(len(thresholds), len(COUNT_COLUMNS))
+
+
+def sweep_predicate_chunk(keys: List[Tuple[str, int]]) -> np.ndarray:
+    sys_index, grt_index = POOL_STATE['sys_index'], POOL_STATE['grt_index']
+    thresholds = POOL_STATE['thresholds']
+    total = np.zeros((len(thresholds), len(COUNT_COLUMNS)), dtype=np.int64)
+    for key in keys:
+        total += sweep_counts(sys_index.roles(key), grt_index.roles(key), thresholds)
+    return total
+
+
+def sweep_datasets(grt_df, sys_df, thresholds: List[float], include_sys_only: bool = False,
+                   workers: int = 1, chunk_size: int = EVAL_CHUNK_SIZE) -> pd.DataFrame:
+    sys_index = as_predicate_index(sys_df)
+    grt_index = as_predicate_index(grt_df)
+    keys = list(yield_paired_keys(sys_index, grt_index, include_sys_only))
+    pool_state = {'sys_index': sys_index, 'grt_index': grt_index, 'thresholds': thresholds}
+    counts = sum_chunk_counts(sweep_predicate_chunk, keys, pool_state, len(thresholds), workers, chunk_size)
+
+    sweep = scores_frame(counts)
+    sweep.insert(0, 'threshold', thresholds)
+    return sweep
+
+
+def main(proposed_path: str, reference_path: str, thresholds: List[float], include_sys_only: bool = False,
+         workers: int = 1, use_cache: bool = False, out_path: str = None):
+    thresholds = sorted(set(thresholds))
+    sys_index = PredicateIndex(load_qasrl(proposed_path, use_cache))
+    grt_index = PredicateIndex(load_qasrl(reference_path, use_cache))
+    sweep = sweep_datasets(grt_index, sys_index, thresholds, include_sys_only, workers)
+    with pd.option_context('display.max_columns', None, 'display.width', 250, 'display.precision', 4):
+        print(sweep.to_string(index=False))
+    if out_path is not None:
+        sweep.to_csv(out_path, index=False, encoding="utf-8")
+        print(out_path)
+    return sweep
+
+
+if __name__ == "__main__":
+    ap = ArgumentParser()
+    ap.add_argument("sys_path")
+    ap.add_argument("ground_truth_path")
+    ap.add_argument("--thresholds", type=float, nargs="+", default=DEFAULT_THRESHOLDS,
+                    help=f"IoU thresholds to evaluate with (evaluate_dataset.py uses {MATCH_IOU_THRESHOLD})")
+    ap.add_argument("--include_sys_only", action="store_true",
+                    help="Score predicates that appear only in the system output instead of ignoring them")
+    ap.add_argument("--workers", type=int, default=1, help="Number of processes used to score predicates")
+    ap.add_argument("--cache", action="store_true",
+                    help="Load decoded datasets from a binary cache next to each CSV, building it if needed")
+    ap.add_argument("--out", required=False, help="/path/to/threshold_sweep.csv")
+    args = ap.parse_args()
+    main(args.sys_path, args.ground_truth_path, args.thresholds, args.include_sys_only, args.workers,
+         args.cache, args.out)
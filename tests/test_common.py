@@ -0,0 +1,47 @@
+import os
+import pickle
+import subprocess
+import sys
+
+from common import Question, Role
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts")
+
+PICKLE_ROLES = """
+import pickle, sys
+from common import Question, Role
+question = Question(text="Who sold something?", wh="Who", subj="someone", obj="something", aux="_", prep="_",
+                    obj2="_", is_passive=False, is_negated=False, paraphrase_id=3)
+sys.stdout.buffer.write(pickle.dumps([Role(question, [(0, 2)])]))
+"""
+
+CHECK_ROLES = """
+import pickle, sys
+roles = pickle.loads(sys.stdin.buffer.read())
+question = roles[0].question
+assert hash(question) == hash(question.text)
+assert {question: 1}[pickle.loads(pickle.dumps(question))] == 1
+print(question.text, question.wh, question.paraphrase_id, roles[0].arguments)
+"""
+
+
+def run_python(code: str, hash_seed: str, stdin: bytes = b"") -> bytes:
+    env = dict(os.environ, PYTHONHASHSEED=hash_seed, PYTHONPATH=SCRIPTS_DIR)
+    return subprocess.run([sys.executable, "-c", code], input=stdin, env=env, check=True,
+                          stdout=subprocess.PIPE).stdout
+
+
+def test_questions_unpickled_in_another_process_hash_their_text():
+    # As when questions are sent to a spawned pool process, whose str hashes are salted differently
+    payload = run_python(PICKLE_ROLES, hash_seed="1")
+    output = run_python(CHECK_ROLES, hash_seed="2", stdin=payload)
+    assert output.decode("utf-8").split() == ["Who", "sold", "something?", "who", "3", "((0,", "2),)"]
+
+
+def test_pickled_question_keeps_its_slots():
+    question = Question(text="What was sold?", wh="what", subj="_", obj="_", aux="was", prep="_", obj2="_",
+                        is_passive=True, is_negated=False)
+    copy = pickle.loads(pickle.dumps(question))
+    assert [getattr(copy, slot) for slot in Question.__slots__] == \
+           [getattr(question, slot) for slot in Question.__slots__]
+    assert hash(copy) == hash(question)
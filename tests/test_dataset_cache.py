@@ -0,0 +1,45 @@
+import os
+
+import pandas as pd
+
+from dataset_cache import SPAN_ARRAYS, get_cache_path, load_qasrl
+from decode_encode_answers import NO_RANGE
+from evaluate_dataset import PredicateIndex, index_by_worker
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+GOLD_PATH = os.path.join(DATA_DIR, "gold", "wikinews.dev.gold.csv")
+
+
+def all_roles(index: PredicateIndex) -> list:
+    return [(key, [(role.question.text, role.arguments) for role in index.roles(key)]) for key in index.keys()]
+
+
+def write_dataset(tmp_path) -> str:
+    qasrl_df = pd.read_csv(GOLD_PATH).head(2000)
+    qasrl_df.loc[qasrl_df.index % 50 == 0, 'answer_range'] = NO_RANGE
+    qasrl_df.loc[qasrl_df.index % 7 == 0, 'worker_id'] = "W2"
+    csv_path = str(tmp_path / "dataset.csv")
+    qasrl_df.to_csv(csv_path, index=False)
+    return csv_path
+
+
+def test_cached_frames_give_the_same_roles(tmp_path):
+    csv_path = write_dataset(tmp_path)
+    decoded_df = load_qasrl(csv_path, use_cache=False)
+    expected = all_roles(PredicateIndex(decoded_df))
+    # The run that builds the cache and the ones that read it
+    for _ in range(2):
+        cached_df = load_qasrl(csv_path, use_cache=True)
+        assert os.path.isdir(get_cache_path(csv_path))
+        assert SPAN_ARRAYS in cached_df.attrs
+        assert all_roles(PredicateIndex(cached_df)) == expected
+
+
+def test_cached_frames_keep_their_spans_by_worker(tmp_path):
+    csv_path = write_dataset(tmp_path)
+    expected = {worker_id: all_roles(index)
+                for worker_id, index in index_by_worker(load_qasrl(csv_path, use_cache=False)).items()}
+    load_qasrl(csv_path, use_cache=True)
+    cached = {worker_id: all_roles(index)
+              for worker_id, index in index_by_worker(load_qasrl(csv_path, use_cache=True)).items()}
+    assert cached == expected
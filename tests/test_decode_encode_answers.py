@@ -0,0 +1,62 @@
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from decode_encode_answers import NO_RANGE, decode_argument, decode_arguments, decode_qasrl, decode_span_arrays, \
+    encode_argument, encode_arguments, encode_qasrl, encode_span_arrays
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+ARG_STRS = ["3:4", "3:4~!~5:6~!~7:8", "-1:3", " 1 : 2", "1:2:3", NO_RANGE, "NO_RANGE~!~1:2", "0:0"]
+MALFORMED_ARG_STRS = ["a:b", "5", "1.0:2", "", "1:2~!~", "1:2~!~NO_RANGE"]
+DATASET_PATHS = sorted(glob.glob(os.path.join(DATA_DIR, "gold", "*.csv")) +
+                       glob.glob(os.path.join(DATA_DIR, "ground_truth", "*.csv")))
+
+
+def test_decode_arguments_matches_decode_argument():
+    arg_strs = pd.Series(ARG_STRS, index=np.arange(len(ARG_STRS)) * 2)
+    decoded = decode_arguments(arg_strs)
+    assert decoded.index.equals(arg_strs.index)
+    assert decoded.tolist() == [decode_argument(arg_str) for arg_str in ARG_STRS]
+
+
+@pytest.mark.parametrize("arg_str", MALFORMED_ARG_STRS)
+def test_decode_arguments_raises_like_decode_argument(arg_str):
+    with pytest.raises(Exception) as expected:
+        decode_argument(arg_str)
+    with pytest.raises(expected.type):
+        decode_arguments(pd.Series(["1:2", arg_str]))
+
+
+def test_encode_arguments_matches_encode_argument():
+    arguments = pd.Series([decode_argument(arg_str) for arg_str in ARG_STRS])
+    assert encode_arguments(arguments) == [encode_argument(arg) for arg in arguments]
+
+
+def test_encode_span_arrays_inverts_decode_span_arrays():
+    arg_strs = pd.Series([arg_str for arg_str in ARG_STRS if not arg_str.startswith(NO_RANGE)] + [NO_RANGE])
+    starts, ends, offsets, no_range_values = decode_span_arrays(arg_strs)
+    is_no_range = np.zeros(len(arg_strs), dtype=bool)
+    is_no_range[no_range_values.index] = True
+    expected = [encode_argument(decode_argument(arg_str)) for arg_str in arg_strs]
+    assert encode_span_arrays(starts, ends, offsets, is_no_range) == expected
+
+
+def test_empty_column():
+    assert decode_arguments(pd.Series([], dtype=object)).tolist() == []
+    assert encode_arguments(pd.Series([], dtype=object)) == []
+
+
+@pytest.mark.parametrize("dataset_path", DATASET_PATHS, ids=os.path.basename)
+def test_dataset_round_trip(dataset_path):
+    df = pd.read_csv(dataset_path)
+    vectorized = decode_qasrl(df.copy())
+    per_row = decode_qasrl(df.copy(), vectorized=False)
+    pd.testing.assert_frame_equal(vectorized, per_row)
+
+    encoded = encode_qasrl(vectorized)
+    pd.testing.assert_frame_equal(encoded, encode_qasrl(per_row, vectorized=False))
+    answer_cols = [col for col in df.columns if "answer" in col]
+    pd.testing.assert_frame_equal(encoded[answer_cols], df.loc[encoded.index, answer_cols])
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from decode_encode_answers import decode_qasrl
+from evaluate import MATCH_IOU_THRESHOLD, iou, match_arguments
+from evaluate_dataset import eval_datasets
+from synthetic_qasrl import WH_VALUES, generate_workload
+
+
+def evaluate_frames(grt_df: pd.DataFrame, sys_df: pd.DataFrame, matching_backend: str = None):
+    metrics = eval_datasets(decode_qasrl(grt_df.copy()), decode_qasrl(sys_df.copy()),
+                            matching_backend=matching_backend)
+    return [metric.as_tuple() for metric in metrics]
+
+
+def wrong_wh_copy(qasrl_df: pd.DataFrame) -> pd.DataFrame:
+    wh_values = WH_VALUES[0]
+    copy_df = qasrl_df.copy()
+    copy_df['wh'] = [wh_values[(wh_values.index(wh) + 1) % len(wh_values)] for wh in qasrl_df.wh]
+    copy_df['question'] = [new_wh.capitalize() + text[len(wh):]
+                           for new_wh, wh, text in zip(copy_df.wh, qasrl_df.wh, qasrl_df.question)]
+    return copy_df
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_padded_questions_do_not_raise_scores(seed):
+    grt_df, sys_df, _ = generate_workload(300, seed=seed)
+    for plain_df in [grt_df, sys_df]:
+        padded_df = pd.concat([plain_df, wrong_wh_copy(plain_df)], ignore_index=True)
+        plain = evaluate_frames(grt_df, plain_df)
+        padded = evaluate_frames(grt_df, padded_df)
+        # Same spans, so the same unlabeled matches
+        assert padded[0] == plain[0]
+        assert padded[1][0] <= plain[1][0]
+        assert padded[2][0] <= plain[2][0]
+
+
+def random_spans(rng: np.random.Generator, n_spans: int, sentence_length: int = 20) -> list:
+    starts = rng.integers(0, sentence_length - 1, size=n_spans)
+    lengths = rng.integers(1, 6, size=n_spans)
+    return sorted(set(zip(starts.tolist(), np.minimum(starts + lengths, sentence_length).tolist())))
+
+
+def matching_weight(sys_to_grt_arg: dict) -> float:
+    return sum(iou(sys_arg, grt_arg) for sys_arg, grt_arg in sys_to_grt_arg.items())
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_assignment_backend_matches_networkx(seed):
+    # Tied matchings may pair different spans, but their size and total IoU are the same
+    rng = np.random.default_rng(seed)
+    for _ in range(200):
+        sys_args = set(random_spans(rng, int(rng.integers(0, 9))))
+        grt_args = set(random_spans(rng, int(rng.integers(0, 9))))
+        reference, reference_unmatched, _ = match_arguments(grt_args, sys_args, 'networkx')
+        matched, unmatched, _ = match_arguments(grt_args, sys_args, 'assignment')
+        assert len(matched) == len(reference)
+        assert matching_weight(matched) == pytest.approx(matching_weight(reference))
+        assert all(iou(sys_arg, grt_arg) >= MATCH_IOU_THRESHOLD for sys_arg, grt_arg in matched.items())
+        assert sorted(unmatched) == sorted(reference_unmatched)
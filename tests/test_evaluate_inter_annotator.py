@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from decode_encode_answers import decode_qasrl
+from evaluate_dataset import eval_datasets
+from evaluate_inter_annotator import agreement_matrix, evaluate_pairwise_agreement
+from synthetic_qasrl import generate_workload
+
+
+def worker_frames():
+    gold_df, sys_df, _ = generate_workload(200, seed=0)
+    predicates = gold_df.qasrl_id.unique()
+    first_half = gold_df.qasrl_id.isin(predicates[: len(predicates) // 2])
+    # W3 and W4 annotate disjoint predicates, so they share nothing
+    return {'W1': gold_df, 'W2': sys_df,
+            'W3': gold_df[first_half], 'W4': sys_df[~sys_df.qasrl_id.isin(predicates[: len(predicates) // 2])]}
+
+
+def shared_scores(df1: pd.DataFrame, df2: pd.DataFrame):
+    cols = ['qasrl_id', 'verb_idx']
+    shared = df1[cols].drop_duplicates().merge(df2[cols].drop_duplicates())
+    df1, df2 = df1.merge(shared), df2.merge(shared)
+    arg, labeled_arg, _ = eval_datasets(decode_qasrl(df1.copy()), decode_qasrl(df2.copy()))
+    return arg.f1(), labeled_arg.f1()
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_agreement_matrices(workers):
+    frames = worker_frames()
+    annot_df = pd.concat([df.assign(worker_id=worker_id) for worker_id, df in frames.items()], ignore_index=True)
+    pairs_df = evaluate_pairwise_agreement(decode_qasrl(annot_df), workers)
+    f1_matrix = agreement_matrix(pairs_df, 'f1')
+    label_f1_matrix = agreement_matrix(pairs_df, 'label_f1')
+
+    assert list(f1_matrix.index) == list(f1_matrix.columns) == ['W1', 'W2', 'W3', 'W4']
+    for matrix in [f1_matrix, label_f1_matrix]:
+        assert matrix.equals(matrix.T)
+        assert np.isnan(np.diag(matrix.values)).all()
+    assert np.isnan(f1_matrix.loc['W3', 'W4'])
+
+    for w1, w2 in [('W1', 'W2'), ('W1', 'W3'), ('W2', 'W4')]:
+        f1, label_f1 = shared_scores(frames[w1], frames[w2])
+        assert f1_matrix.loc[w1, w2] == pytest.approx(f1)
+        assert label_f1_matrix.loc[w1, w2] == pytest.approx(label_f1)
+    # W3 is a subset of W1
+    assert f1_matrix.loc['W1', 'W3'] == label_f1_matrix.loc['W1', 'W3'] == 1.0
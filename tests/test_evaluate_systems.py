@@ -0,0 +1,38 @@
+import multiprocessing
+import os
+
+import pandas as pd
+
+import evaluate_dataset
+import evaluate_systems
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+GOLD_PATH = os.path.join(DATA_DIR, "gold", "wikinews.dev.gold.csv")
+
+
+def write_systems(tmp_path, n_predicates: int = 200):
+    gold_df = pd.read_csv(GOLD_PATH)
+    keys = gold_df[['qasrl_id', 'verb_idx']].drop_duplicates().head(n_predicates)
+    gold_df = gold_df.merge(keys)
+    gold_path = str(tmp_path / "gold.csv")
+    gold_df.to_csv(gold_path, index=False)
+
+    sys_a = gold_df.sample(frac=0.7, random_state=0).sort_index()
+    # Some questions get a wh slot the gold never uses with them, so new paraphrase classes appear
+    sys_b = gold_df.copy()
+    sys_b.loc[sys_b.index % 3 == 0, 'wh'] = sys_b.wh.map({'what': 'who', 'who': 'what', 'when': 'where'})
+    sys_b.loc[sys_b.index % 5 == 0, 'wh'] = None
+    sys_paths = [str(tmp_path / "sys_a.csv"), str(tmp_path / "sys_b.csv")]
+    sys_a.to_csv(sys_paths[0], index=False)
+    sys_b.to_csv(sys_paths[1], index=False)
+    return gold_path, sys_paths
+
+
+def test_spawned_pool_matches_serial_leaderboard(tmp_path, monkeypatch):
+    gold_path, sys_paths = write_systems(tmp_path)
+    serial = evaluate_systems.main(gold_path, sys_paths)
+    # Spawned processes do not inherit the paraphrase classes assigned to the gold questions
+    monkeypatch.setattr(evaluate_dataset, "Pool", multiprocessing.get_context("spawn").Pool)
+    parallel = evaluate_systems.main(gold_path, sys_paths, workers=2)
+    pd.testing.assert_frame_equal(serial, parallel)
+    assert (serial.label_arg_tp < serial.arg_tp).any()
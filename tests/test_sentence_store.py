@@ -0,0 +1,37 @@
+import pandas as pd
+import pytest
+
+from decode_encode_answers import NO_RANGE
+from evaluate_dataset import SentenceText
+from sentence_store import SentenceStore, load_sentences
+
+
+def write_sentences(tmp_path) -> str:
+    sents_df = pd.DataFrame({'qasrl_id': ["wiki:1_0", "wiki:1_1", "wiki:10_2", "émigré:3_0"],
+                             'tokens': ["The cat sat .", "Ça a coûté 5 € .", "A", "Un émigré est arrivé"]})
+    sents_path = str(tmp_path / "sentences.csv")
+    sents_df.to_csv(sents_path, index=False)
+    return sents_path
+
+
+def test_store_matches_token_lists(tmp_path):
+    sents_path = write_sentences(tmp_path)
+    sent_map = load_sentences(sents_path)
+    store = load_sentences(sents_path, use_store=True)
+    assert isinstance(store, SentenceStore)
+    assert len(store) == len(sent_map)
+
+    spans = [(0, 2), (1, 100), (-2, 5), (3, 1), (2, 3), NO_RANGE]
+    for qasrl_id, tokens in sent_map.items():
+        assert qasrl_id in store
+        assert store[qasrl_id] == tokens
+        assert store.sentence(qasrl_id).span_texts(spans) == SentenceText(tokens).span_texts(spans)
+
+
+@pytest.mark.parametrize("qasrl_id", ["wiki:1_2", "wiki:1", "a much longer id than any stored one", 7])
+def test_unknown_ids_raise_key_error(tmp_path, qasrl_id):
+    store = load_sentences(write_sentences(tmp_path), use_store=True)
+    assert qasrl_id not in store
+    with pytest.raises(KeyError) as error:
+        store.sentence(qasrl_id)
+    assert error.value.args == (qasrl_id,)
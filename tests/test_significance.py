@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from evaluate_dataset import COUNT_COLUMNS
+from significance import MAX_BATCH_CELLS, bootstrap_ci, paired_permutation_test, resample_batch_size
+
+
+def count_table(rng: np.random.Generator, n_predicates: int) -> pd.DataFrame:
+    table = pd.DataFrame(rng.integers(0, 5, size=(n_predicates, len(COUNT_COLUMNS))), columns=COUNT_COLUMNS)
+    table.insert(0, 'qasrl_id', [f"sent{idx}" for idx in range(n_predicates)])
+    table.insert(1, 'verb_idx', 0)
+    return table
+
+
+@pytest.mark.parametrize("n_rows", [1, 300, MAX_BATCH_CELLS, 10 * MAX_BATCH_CELLS])
+def test_batch_size_is_bounded(n_rows):
+    batch_size = resample_batch_size(n_rows, 10000)
+    assert 1 <= batch_size <= 10000
+    assert batch_size == 1 or batch_size * n_rows <= MAX_BATCH_CELLS
+    assert resample_batch_size(n_rows, 10000, batch_size=64) == 64
+
+
+def test_scores_do_not_depend_on_batch_size():
+    rng = np.random.default_rng(0)
+    table_a, table_b = count_table(rng, 300), count_table(rng, 300)
+    ci = [bootstrap_ci(table_a, 500, seed=1, batch_size=batch_size) for batch_size in [7, 500, None]]
+    tests = [paired_permutation_test(table_a, table_b, 500, seed=1, batch_size=batch_size)
+             for batch_size in [7, 500, None]]
+    for results in [ci, tests]:
+        for result in results[1:]:
+            pd.testing.assert_frame_equal(result, results[0])
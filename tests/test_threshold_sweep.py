@@ -0,0 +1,21 @@
+import multiprocessing
+
+from decode_encode_answers import decode_qasrl
+from evaluate import MATCH_IOU_THRESHOLD
+import evaluate_dataset
+from evaluate_dataset import COUNT_COLUMNS, eval_datasets
+from synthetic_qasrl import generate_workload
+from threshold_sweep import sweep_datasets
+
+
+def test_spawned_sweep_matches_serial(monkeypatch):
+    grt_df, sys_df, _ = generate_workload(300, noise=0.3, overlap=0.2, seed=0)
+    grt_df, sys_df = decode_qasrl(grt_df), decode_qasrl(sys_df)
+    thresholds = [0.3, MATCH_IOU_THRESHOLD, 0.9]
+    serial = sweep_datasets(grt_df, sys_df, thresholds, chunk_size=16)
+    monkeypatch.setattr(evaluate_dataset, "Pool", multiprocessing.get_context("spawn").Pool)
+    parallel = sweep_datasets(grt_df, sys_df, thresholds, workers=2, chunk_size=16)
+    assert serial.equals(parallel)
+
+    counts = [count for metric in eval_datasets(grt_df, sys_df) for count in metric.as_tuple()]
+    assert serial.loc[thresholds.index(MATCH_IOU_THRESHOLD), COUNT_COLUMNS].tolist() == counts